@@ -16,25 +16,73 @@
 Author: 倉持誠 (Makoto Kuramochi)
 """
 
+from concurrent.futures import ProcessPoolExecutor
 from typing import List, Dict, Tuple, Optional
 import numpy as np
-import json
 from extended_kemeny_rule import ExtendedKemenyRule
 from deferred_acceptance import DeferredAcceptanceAlgorithm
 from validation import InputValidator, ConstraintViolationError
+from result_writer import ResultWriter
+
+
+# ワーカープロセスごとに1度だけ受け取る集約ルール（ジョブごとに送らない）
+_worker_kemeny_rule: Optional[ExtendedKemenyRule] = None
+
+
+def _init_aggregation_worker(kemeny_rule: ExtendedKemenyRule):
+    """ワーカープロセスの初期化: 集約ルールを保持する"""
+    global _worker_kemeny_rule
+    _worker_kemeny_rule = kemeny_rule
+
+
+def _aggregate_chunk(jobs: List[Tuple[int, List[int], List[int], List[int]]],
+                     kemeny_rule: Optional[ExtendedKemenyRule] = None) -> List[Tuple]:
+    """
+    ジョブのまとまりを順に集約する（ワーカープロセス内で実行）
+
+    1人の失敗が同じまとまりの他のエージェントに波及しないよう、
+    例外はエージェントごとに捕まえて結果として返す。
+
+    Args:
+        jobs: (ジョブ番号, 主観的選好, フィット度, 候補者リスト) のリスト
+        kemeny_rule: 集約ルール（省略時はワーカー初期化時に受け取ったもの）
+
+    Returns:
+        List[Tuple]: (ジョブ番号, 最適ランキング, 計算詳細, 例外 or None) のリスト
+    """
+    rule = kemeny_rule if kemeny_rule is not None else _worker_kemeny_rule
+    results = []
+    for index, preference, fitness, candidates in jobs:
+        try:
+            ranking, details = rule.aggregate_preferences(preference, fitness, candidates)
+            results.append((index, ranking, details, None))
+        except Exception as e:
+            results.append((index, None, None, e))
+    return results
 
 
 class CareMatchingSystem:
     """ケアマッチングシステムのメインクラス"""
     
-    def __init__(self, preference_weight: float = 1.0, fitness_weight: float = 1.0):
+    # 並列集約でワーカー1つあたりに作るジョブのまとまりの数（負荷の偏りをならす）
+    CHUNKS_PER_WORKER = 4
+
+    def __init__(self, preference_weight: float = 1.0, fitness_weight: float = 1.0,
+                 workers: Optional[int] = None, strict: bool = False):
         """
         マッチングシステムの初期化
         
         Args:
             preference_weight: 主観的選好の重み
             fitness_weight: 客観的フィット度の重み
+            workers: 選好統合に使うプロセス数の既定値（None または 1 で逐次実行）
+            strict: 選好統合に失敗したエージェントがあれば例外を送出するか（既定は
+                失敗したエージェントを除いてマッチングを続ける）
         """
+        if workers is not None and workers < 1:
+            raise ValueError("workers は1以上を指定してください")
+        self.workers = workers
+        self.strict = strict
         self.kemeny_rule = ExtendedKemenyRule(preference_weight, fitness_weight)
         self.da_algorithm = DeferredAcceptanceAlgorithm()
         self.preference_weight = preference_weight
@@ -84,49 +132,172 @@ class CareMatchingSystem:
             }
         }
     
-    def aggregate_all_preferences(self, data: Dict) -> Tuple[Dict, Dict, Dict]:
+    def aggregate_all_preferences(self, data: Dict,
+                                  workers: Optional[int] = None,
+                                  strict: Optional[bool] = None) -> Tuple[Dict, Dict, Dict]:
         """
         全ての主観的選好と客観的フィット度を統合
         
+        失敗はエージェント単位で扱う。統合に失敗したエージェントは統合選好に含めず、
+        詳細情報の integration_details[側][ID] に {'error': 例外の repr} を記録して、
+        他のエージェントの結果は入力順のまま返す（workers の指定によらず同じ）。
+        
         Args:
             data: サンプルデータ辞書
+            workers: 並列実行するプロセス数（省略時は初期化時の値。None または 1 で
+                逐次実行）。2以上ではエージェントごとの集約を ProcessPoolExecutor に分散する
+            strict: True なら全エージェントの集約後、失敗があれば1つの
+                ConstraintViolationError にまとめて送出する（省略時は初期化時の値）
             
         Returns:
             Tuple: 統合された被介護者選好、ケアワーカー選好、詳細情報
+            
+        Raises:
+            ConstraintViolationError: strict=True で統合に失敗したエージェントがある場合。
+                例外の results 属性に上記の戻り値（成功分のみ）を持つ
         """
-        recipient_integrated_preferences = {}
-        caregiver_integrated_preferences = {}
+        if workers is None:
+            workers = self.workers
+        if strict is None:
+            strict = self.strict
+        if workers is not None and workers < 1:
+            raise ValueError("workers は1以上を指定してください")
+        
+        agents, jobs = self._aggregation_jobs(data)
+        if workers is not None and workers > 1:
+            outcomes = self._run_aggregation_jobs_parallel(jobs, workers)
+        else:
+            outcomes = self._run_aggregation_jobs(agents, jobs)
+        
+        integrated_preferences = {'recipients': {}, 'caregivers': {}}
         integration_details = {'recipients': {}, 'caregivers': {}}
+        failures = []
+        for (side, agent_id), (ranking, details, error) in zip(agents, outcomes):
+            if error is not None:
+                integration_details[side][agent_id] = {'error': repr(error)}
+                failures.append((side, agent_id, error))
+            else:
+                integrated_preferences[side][agent_id] = ranking
+                integration_details[side][agent_id] = details
+        results = (integrated_preferences['recipients'], integrated_preferences['caregivers'],
+                   integration_details)
+        
+        if failures:
+            labels = {'recipients': '被介護者', 'caregivers': 'ケアワーカー'}
+            failed = ", ".join(f"{labels[side]}{agent_id}" for side, agent_id, _ in failures)
+            print(f"❌ 選好統合に失敗したエージェント: {failed}")
+            if strict:
+                error = ConstraintViolationError(
+                    "選好統合に失敗したエージェントがあります: " + "; ".join(
+                        f"{labels[side]}{agent_id}: {e}" for side, agent_id, e in failures
+                    )
+                )
+                error.results = results
+                raise error
+        
+        return results
+    
+    @staticmethod
+    def _aggregation_jobs(data: Dict) -> Tuple[List[Tuple[str, int]], List[Tuple]]:
+        """
+        エージェントごとの集約ジョブを入力順（被介護者、ケアワーカーの順）に作る
         
-        # 被介護者の選好統合
-        for recipient_id in data['care_recipients']:
-            subjective_pref = data['recipient_subjective_preferences'][recipient_id]
-            fitness_scores = data['fitness_scores'][recipient_id]
-            
-            # 候補者リストはケアワーカーIDそのもの
-            candidates = data['caregivers'].copy()
-            
-            integrated_pref, details = self.kemeny_rule.aggregate_preferences(
-                subjective_pref, fitness_scores, candidates
-            )
-            
-            recipient_integrated_preferences[recipient_id] = integrated_pref
-            integration_details['recipients'][recipient_id] = details
-        
-        # ケアワーカーの選好統合
-        for caregiver_id in data['caregivers']:
-            subjective_pref = data['caregiver_subjective_preferences'][caregiver_id]
-            fitness_scores = data['caregiver_fitness_scores'][caregiver_id]
-            candidates = data['care_recipients']
-            
-            integrated_pref, details = self.kemeny_rule.aggregate_preferences(
-                subjective_pref, fitness_scores, candidates
-            )
-            
-            caregiver_integrated_preferences[caregiver_id] = integrated_pref
-            integration_details['caregivers'][caregiver_id] = details
+        Returns:
+            Tuple: [(側, エージェントID)] と
+            [(ジョブ番号, 主観的選好, フィット度, 候補者リスト)]（入力が欠けていれば None）
+        """
+        sides = (
+            ('recipients', data['care_recipients'], data['recipient_subjective_preferences'],
+             data['fitness_scores'], data['caregivers']),
+            ('caregivers', data['caregivers'], data['caregiver_subjective_preferences'],
+             data['caregiver_fitness_scores'], data['care_recipients']),
+        )
+        agents = []
+        jobs = []
+        for side, agent_ids, preferences, fitness_scores, candidates in sides:
+            for agent_id in agent_ids:
+                preference = preferences.get(agent_id)
+                fitness = fitness_scores.get(agent_id)
+                jobs.append((len(jobs),
+                             None if preference is None else list(preference),
+                             None if fitness is None else list(fitness),
+                             list(candidates)))
+                agents.append((side, agent_id))
+        return agents, jobs
+    
+    def _run_aggregation_jobs(self, agents: List[Tuple[str, int]],
+                              jobs: List[Tuple]) -> List[Tuple]:
+        """
+        集約ジョブを逐次実行し、(最適ランキング, 計算詳細, 例外 or None) を入力順に返す
         
-        return recipient_integrated_preferences, caregiver_integrated_preferences, integration_details
+        各側（候補者リストが全員で共通）は aggregate_batch で一括処理し、
+        一括処理が失敗した側だけエージェントごとに解き直して失敗を切り分ける。
+        """
+        outcomes = []
+        for side in ('recipients', 'caregivers'):
+            side_jobs = [job for (job_side, _), job in zip(agents, jobs) if job_side == side]
+            if not side_jobs:
+                continue
+            try:
+                rankings, details_list = self.kemeny_rule.aggregate_batch(
+                    np.array([job[1] for job in side_jobs]),
+                    np.array([job[2] for job in side_jobs]),
+                    side_jobs[0][3]
+                )
+                outcomes.extend((ranking, details, None)
+                                for ranking, details in zip(rankings, details_list))
+            except Exception:
+                outcomes.extend((ranking, details, error) for _, ranking, details, error
+                                in _aggregate_chunk(side_jobs, self.kemeny_rule))
+        return outcomes
+    
+    def _chunk_jobs(self, jobs: List[Tuple], workers: int) -> List[List[Tuple]]:
+        """
+        推定計算量の大きい順にジョブを並べ、計算量がほぼ均等なまとまりに分割
+        
+        目安の量（全体 / (workers × CHUNKS_PER_WORKER)）を超えるジョブは単独の
+        まとまりになり、小さなジョブは目安に達するまでまとめて送る。
+        大きいまとまりから投入するので、重いジョブが最後に残りにくい。
+        """
+        costs = [self.kemeny_rule.estimate_cost(len(job[3])) for job in jobs]
+        order = sorted(range(len(jobs)), key=lambda i: -costs[i])
+        target = sum(costs) / (workers * self.CHUNKS_PER_WORKER)
+        
+        chunks = []
+        chunk, chunk_cost = [], 0.0
+        for i in order:
+            chunk.append(jobs[i])
+            chunk_cost += costs[i]
+            if chunk_cost >= target:
+                chunks.append(chunk)
+                chunk, chunk_cost = [], 0.0
+        if chunk:
+            chunks.append(chunk)
+        return chunks
+    
+    def _run_aggregation_jobs_parallel(self, jobs: List[Tuple], workers: int) -> List[Tuple]:
+        """
+        集約ジョブを ProcessPoolExecutor で実行し、(最適ランキング, 計算詳細, 例外 or None) を
+        入力順に返す
+        
+        例外はワーカー内でエージェントごとに捕まえる。ワーカープロセスの異常終了などで
+        まとまりごと失敗した場合は、そのまとまりをこのプロセスで計算し直す。
+        キャッシュ（cache_size）はワーカーごとに持つため、プロセス間では共有されない。
+        """
+        outcomes: List[Optional[Tuple]] = [None] * len(jobs)
+        chunks = self._chunk_jobs(jobs, workers)
+        with ProcessPoolExecutor(max_workers=min(workers, len(chunks)) or 1,
+                                 initializer=_init_aggregation_worker,
+                                 initargs=(self.kemeny_rule,)) as executor:
+            futures = [(chunk, executor.submit(_aggregate_chunk, chunk)) for chunk in chunks]
+            for chunk, future in futures:
+                try:
+                    chunk_results = future.result()
+                except Exception:
+                    chunk_results = _aggregate_chunk(chunk, self.kemeny_rule)
+                for index, ranking, details, error in chunk_results:
+                    outcomes[index] = (ranking, details, error)
+        return outcomes
     
     def run_complete_matching(self, data: Optional[Dict] = None) -> Dict:
         """
@@ -183,9 +354,17 @@ class CareMatchingSystem:
         print("ステップ2: DAアルゴリズムによるマッチング")
         print("-" * 50)
         
+        # 選好統合に失敗したエージェントは DA に参加させない
+        if (len(recipient_prefs) < len(data['care_recipients']) or
+                len(caregiver_prefs) < len(data['caregivers'])):
+            recipient_prefs = {r: [c for c in pref if c in caregiver_prefs]
+                               for r, pref in recipient_prefs.items()}
+            caregiver_prefs = {c: [r for r in pref if r in recipient_prefs]
+                               for c, pref in caregiver_prefs.items()}
+        
         matches, da_details = self.da_algorithm.create_match(
-            data['care_recipients'],
-            data['caregivers'],
+            [r for r in data['care_recipients'] if r in recipient_prefs],
+            [c for c in data['caregivers'] if c in caregiver_prefs],
             recipient_prefs,
             caregiver_prefs,
             data['caregiver_capacities']
@@ -288,29 +467,20 @@ class CareMatchingSystem:
             avg_caregiver_satisfaction = np.mean(list(caregiver_satisfaction.values()))
             print(f"ケアワーカー平均満足度: {avg_caregiver_satisfaction:.3f}")
     
-    def save_results_to_file(self, results: Dict, filename: str):
+    def save_results_to_file(self, results: Dict, filename: str,
+                             format: str = "json", calculation_details: str = "all"):
         """
-        結果をJSONファイルに保存
+        結果をファイルに保存
         
         Args:
             results: 結果辞書
             filename: 保存ファイル名
+            format: "json"（1つの JSON 文書）/ "ndjson"（エージェント・マッチごとに
+                1行ずつ逐次書き出し）/ "binary"（統合選好とマッチングの圧縮 .npz）
+            calculation_details: 計算詳細を "all"（全て）/ "summary"（件数のみ）/
+                "none"（省略）のどれで保存するか
         """
-        # numpy配列をリストに変換して保存可能にする
-        def convert_numpy(obj):
-            if isinstance(obj, np.ndarray):
-                return obj.tolist()
-            elif isinstance(obj, np.integer):
-                return int(obj)
-            elif isinstance(obj, np.floating):
-                return float(obj)
-            return obj
-        
-        # 結果を保存用に変換
-        save_data = json.loads(json.dumps(results, default=convert_numpy))
-        
-        with open(filename, 'w', encoding='utf-8') as f:
-            json.dump(save_data, f, ensure_ascii=False, indent=2)
+        ResultWriter(calculation_details).write(results, filename, format)
         
         print(f"結果を {filename} に保存しました")
 
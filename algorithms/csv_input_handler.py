@@ -0,0 +1,430 @@
+#!/usr/bin/env python3
+"""
+CSV入力ハンドラー
+
+docs/CSV_INPUT_GUIDE.md の形式（被介護者・ケアワーカーそれぞれの主観的選好
+ランキング行列と客観的フィット度行列、ケアワーカーの容量）を読み込み、
+CSVMatchingSystem が使う辞書形式に変換します。
+
+各行列はヘッダー行（列 = 相手側ID）を1度だけ ID の索引に変換し、本体は
+NumPy 配列として一括で数値化します。ランキング行列から選好順リストへの
+変換は行ごとの argsort で一括に行い、複数ファイルはスレッドで並行して読み込みます。
+cache_dir を指定すると、解析結果をファイル内容のハッシュをキーとしたバイナリ形式
+（instance_format.MatchingInstance）で保存し、同じ内容の再読み込みでは解析を省きます。
+
+Author: 倉持誠 (Makoto Kuramochi)
+"""
+
+import csv
+import hashlib
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+from validation import InputValidator, ConstraintViolationError
+from instance_format import MatchingInstance
+
+
+class CSVInputHandler:
+    """CSVファイルからマッチング用データを読み込むクラス"""
+
+    # 小数のフィット度を整数化するときに許す小数点以下の最大桁数
+    MAX_FITNESS_DECIMALS = 6
+    # 全フィット度ファイル共通の整数化の倍率（ファイルの書式によらず差の大きさを揃える）
+    FITNESS_SCALE = 10 ** MAX_FITNESS_DECIMALS
+
+    SAMPLE_FILES = {
+        'care_receiver_subjective_preferences.csv': [
+            ['被介護者ID', '1', '2', '3'],
+            ['4', '1', '2', '3'],
+            ['5', '3', '1', '2'],
+            ['6', '2', '3', '1'],
+            ['7', '3', '1', '2'],
+        ],
+        'care_receiver_objective_fitness.csv': [
+            ['被介護者ID', '1', '2', '3'],
+            ['4', '0.9', '0.8', '0.7'],
+            ['5', '0.6', '0.9', '0.8'],
+            ['6', '0.7', '0.5', '0.9'],
+            ['7', '0.8', '0.7', '0.6'],
+        ],
+        'care_worker_subjective_preferences.csv': [
+            ['ケアワーカーID', '4', '5', '6', '7'],
+            ['1', '2', '3', '1', '4'],
+            ['2', '1', '2', '4', '3'],
+            ['3', '4', '1', '2', '3'],
+        ],
+        'care_worker_objective_fitness.csv': [
+            ['ケアワーカーID', '4', '5', '6', '7'],
+            ['1', '0.9', '0.6', '0.7', '0.8'],
+            ['2', '0.8', '0.9', '0.5', '0.7'],
+            ['3', '0.7', '0.8', '0.9', '0.6'],
+        ],
+        'care_worker_capacity.csv': [
+            ['ケアワーカーID', '容量'],
+            ['1', '1'],
+            ['2', '1'],
+            ['3', '1'],
+        ],
+    }
+
+    def __init__(self, cache_dir: Optional[str] = None):
+        """
+        Args:
+            cache_dir: 解析結果のキャッシュを置くディレクトリ（None ならキャッシュしない）
+        """
+        self.cache_dir = cache_dir
+        self.care_receivers_data = {}
+        self.care_workers_data = {}
+        # 整数化のためにフィット度に掛けた倍率 {'care_receivers': 倍率, 'care_workers': 倍率}
+        self.fitness_scales = {}
+        # 主観的選好CSVの列（相手側ID）の並び {'care_receivers': [ID順], 'care_workers': [ID順]}
+        self.column_orders = {}
+
+    @staticmethod
+    def _read_cells(csv_path: str) -> Tuple[List[str], np.ndarray]:
+        """CSVをヘッダー行と前後の空白を除いたセルの文字列配列に分けて読み込む"""
+        with open(csv_path, encoding='utf-8-sig', newline='') as f:
+            rows = [row for row in csv.reader(f) if row and any(cell.strip() for cell in row)]
+        if len(rows) < 2:
+            raise ValueError(f"{csv_path}: ヘッダーとデータ行が必要です")
+
+        header = rows[0]
+        ragged = [i + 2 for i, row in enumerate(rows[1:]) if len(row) != len(header)]
+        if ragged:
+            raise ValueError(f"{csv_path}: 列数がヘッダーと一致しない行があります (行 {ragged[:5]})")
+        return header, np.char.strip(np.array(rows[1:], dtype=str))
+
+    @classmethod
+    def read_matrix(cls, csv_path: str) -> Tuple[List[int], List[int], np.ndarray]:
+        """
+        ワイド形式の行列CSVを一括で読み込む
+
+        1行目は「行ID列名, 列ID, 列ID, ...」のヘッダー、2行目以降は「行ID, 値, ...」。
+        空白セルと NaN は np.nan になる。
+
+        Args:
+            csv_path: CSVファイルのパス
+
+        Returns:
+            Tuple[List[int], List[int], np.ndarray]: 行ID、列ID、値の行列（float64）
+
+        Raises:
+            ValueError: ヘッダー・ID・値が数値として読めない場合、行の長さが揃っていない場合
+        """
+        header, cells = cls._read_cells(csv_path)
+        try:
+            column_ids = np.char.strip(np.array(header[1:], dtype=str)).astype(np.int64)
+            row_ids = cells[:, 0].astype(np.int64)
+            values = np.where(cells[:, 1:] == '', 'nan', cells[:, 1:]).astype(np.float64)
+        except ValueError as e:
+            raise ValueError(f"{csv_path}: 数値として読めないセルがあります ({e})") from e
+
+        return row_ids.tolist(), column_ids.tolist(), values.reshape(len(row_ids), len(header) - 1)
+
+    @staticmethod
+    def rank_matrix_to_preferences(agent_ids: List[int],
+                                   candidate_ids: List[int],
+                                   ranks: np.ndarray) -> Dict[int, List[int]]:
+        """
+        ランキング行列（列 = 候補者、値 = 順位）を選好順の候補者IDリストへ一括変換
+
+        欠損セル（NaN）の候補者は選好リストから除く。順位は各行で1から始まる
+        連続した整数でなければならない。
+
+        Raises:
+            ConstraintViolationError: 順位が1からの連続した整数でない（同順位を含む）場合
+        """
+        missing = np.isnan(ranks)
+        filled = np.where(missing, np.inf, ranks)
+        order = np.argsort(filled, axis=1, kind='stable')
+        counts = (~missing).sum(axis=1)
+
+        # 並べ替えた順位が各行の有効数まで 1, 2, ..., k になっているかを一括判定
+        sorted_ranks = np.take_along_axis(filled, order, axis=1)
+        expected = np.arange(1, ranks.shape[1] + 1)
+        valid = np.arange(ranks.shape[1]) < counts[:, None]
+        bad_rows = np.flatnonzero((valid & (sorted_ranks != expected)).any(axis=1))
+        if len(bad_rows):
+            agent_id = agent_ids[int(bad_rows[0])]
+            raise ConstraintViolationError(
+                f"ID {agent_id} のランキングが1から始まる連続した整数ではありません: "
+                f"{[int(v) if v.is_integer() else v for v in ranks[bad_rows[0]][~missing[bad_rows[0]]].tolist()]}"
+            )
+
+        ordered_ids = np.asarray(candidate_ids, dtype=np.int64)[order].tolist()
+        return {
+            agent_id: ordered_ids[i][:counts[i]]
+            for i, agent_id in enumerate(agent_ids)
+        }
+
+    @classmethod
+    def fitness_to_integers(cls, fitness: np.ndarray) -> Tuple[np.ndarray, int]:
+        """
+        フィット度行列を固定の倍率 FITNESS_SCALE（10^MAX_FITNESS_DECIMALS）倍して整数化する
+
+        制約（validation.py）によりフィット度は整数でなければならないため、
+        0.0-1.0 の小数で書かれた行列を大小関係と差の比を保ったまま整数に変換する。
+        倍率はファイルに書かれた桁数によらず全ファイル共通のため、同じ値を
+        0.8 と書いても 0.80 と書いても同じ整数になり、fitness_mode="gap" での
+        主観的選好との重みの釣り合いも書式に左右されない。欠損セル（NaN）はそのまま残す。
+
+        Returns:
+            Tuple[np.ndarray, int]: 整数化した行列（float64、欠損は NaN）と掛けた倍率
+
+        Raises:
+            ConstraintViolationError: 小数点以下 MAX_FITNESS_DECIMALS 桁以内で表せない場合
+        """
+        scale = cls.FITNESS_SCALE
+        scaled = fitness[~np.isnan(fitness)] * scale
+        if np.allclose(scaled, np.round(scaled), rtol=0, atol=1e-6):
+            return np.round(fitness * scale), scale
+        raise ConstraintViolationError(
+            f"フィット度を小数点以下{cls.MAX_FITNESS_DECIMALS}桁以内の値として整数化できません"
+        )
+
+    def _load_group(self, subjective_csv: str, objective_csv: str,
+                    group: str, executor: ThreadPoolExecutor) -> Dict:
+        subjective_future = executor.submit(self.read_matrix, subjective_csv)
+        objective_future = executor.submit(self.read_matrix, objective_csv)
+        return self._build_group_data(subjective_future.result(), objective_future.result(),
+                                      subjective_csv, objective_csv, group)
+
+    def _build_group_data(self, subjective: Tuple, objective: Tuple,
+                          subjective_csv: str, objective_csv: str, group: str) -> Dict:
+        agent_ids, candidate_ids, ranks = subjective
+        fitness_agent_ids, fitness_candidate_ids, fitness = objective
+
+        # 客観的フィット度の行・列を主観的選好の ID 順に並べ替える（ID の索引は1度だけ作る）
+        row_index = {agent_id: i for i, agent_id in enumerate(fitness_agent_ids)}
+        column_index = {candidate_id: j for j, candidate_id in enumerate(fitness_candidate_ids)}
+        if set(row_index) != set(agent_ids) or set(column_index) != set(candidate_ids):
+            raise ConstraintViolationError(
+                f"{subjective_csv} と {objective_csv} の行IDまたは列IDが一致しません"
+            )
+        fitness = fitness[np.ix_([row_index[a] for a in agent_ids],
+                                 [column_index[c] for c in candidate_ids])]
+        fitness, scale = self.fitness_to_integers(fitness)
+        self.fitness_scales[group] = scale
+        self.column_orders[group] = list(candidate_ids)
+
+        preference_orders = self.rank_matrix_to_preferences(agent_ids, candidate_ids, ranks)
+
+        def rows_to_dicts(matrix: np.ndarray) -> List[Dict[int, int]]:
+            # 整数化してから一括で Python のリストにし、欠損のない行は dict(zip()) で作る
+            missing = np.isnan(matrix)
+            rows = np.where(missing, 0, matrix).astype(np.int64).tolist()
+            present = (~missing).tolist()
+            complete = (~missing.any(axis=1)).tolist()
+            return [
+                dict(zip(candidate_ids, row)) if complete[i] else
+                {c: v for c, v, ok in zip(candidate_ids, row, present[i]) if ok}
+                for i, row in enumerate(rows)
+            ]
+
+        rank_dicts = rows_to_dicts(ranks)
+        fitness_dicts = rows_to_dicts(fitness)
+        return {
+            agent_id: {
+                'subjective_preferences': rank_dicts[i],
+                'objective_fitness': fitness_dicts[i],
+                'preference_order': preference_orders[agent_id]
+            }
+            for i, agent_id in enumerate(agent_ids)
+        }
+
+    @classmethod
+    def read_capacities(cls, capacity_csv: str) -> Dict[int, int]:
+        """
+        ケアワーカーの容量CSV（ケアワーカーID, 容量）を読み込む
+
+        Raises:
+            ValueError: ID・容量が整数として読めない場合
+        """
+        _, cells = cls._read_cells(capacity_csv)
+        try:
+            worker_ids = cells[:, 0].astype(np.int64)
+            capacities = cells[:, 1].astype(np.int64)
+        except (ValueError, IndexError) as e:
+            raise ValueError(f"{capacity_csv}: ケアワーカーIDと容量は整数で指定してください ({e})") from e
+        return dict(zip(worker_ids.tolist(), capacities.tolist()))
+
+    def load_care_receivers_data(self, subjective_csv: str, objective_csv: str) -> Dict:
+        """
+        被介護者の主観的選好とフィット度を読み込む（2ファイルを並行して読み込む）
+
+        Returns:
+            Dict: {被介護者ID: {'subjective_preferences': {ケアワーカーID: 順位},
+                                'objective_fitness': {ケアワーカーID: フィット度},
+                                'preference_order': [ケアワーカーID順]}}
+        """
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            self.care_receivers_data = self._load_group(
+                subjective_csv, objective_csv, 'care_receivers', executor
+            )
+        print(f"被介護者データを読み込みました: {len(self.care_receivers_data)}人")
+        return self.care_receivers_data
+
+    def load_care_workers_data(self, subjective_csv: str, objective_csv: str,
+                               capacity_csv: Optional[str] = None,
+                               default_capacity: int = 1) -> Dict:
+        """
+        ケアワーカーの主観的選好・フィット度・容量を読み込む（ファイルを並行して読み込む）
+
+        Args:
+            capacity_csv: 容量CSV（省略時は全員 default_capacity）
+
+        Returns:
+            Dict: load_care_receivers_data と同じ形式に 'capacity' を加えた辞書
+        """
+        with ThreadPoolExecutor(max_workers=3) as executor:
+            capacity_future = (executor.submit(self.read_capacities, capacity_csv)
+                               if capacity_csv else None)
+            self.care_workers_data = self._load_group(
+                subjective_csv, objective_csv, 'care_workers', executor
+            )
+            capacities = capacity_future.result() if capacity_future else {}
+        for worker_id, data in self.care_workers_data.items():
+            data['capacity'] = capacities.get(worker_id, default_capacity)
+        print(f"ケアワーカーデータを読み込みました: {len(self.care_workers_data)}人")
+        return self.care_workers_data
+
+    def load_all_data(self,
+                      receiver_subjective_csv: str,
+                      receiver_objective_csv: str,
+                      worker_subjective_csv: str,
+                      worker_objective_csv: str,
+                      worker_capacity_csv: Optional[str] = None,
+                      default_capacity: int = 1) -> Tuple[Dict, Dict]:
+        """
+        4つの行列CSVと容量CSVをすべて並行して読み込む
+
+        Returns:
+            Tuple[Dict, Dict]: 被介護者データ、ケアワーカーデータ
+        """
+        paths = [receiver_subjective_csv, receiver_objective_csv,
+                 worker_subjective_csv, worker_objective_csv]
+        cache_path = None
+        if self.cache_dir is not None:
+            cache_path = os.path.join(self.cache_dir, self.content_hash(
+                paths + [worker_capacity_csv], default_capacity
+            ))
+            if os.path.isfile(os.path.join(cache_path, 'meta.json')):
+                instance = MatchingInstance.load(cache_path)
+                data = instance.to_csv_data()
+                self.care_receivers_data = data['care_receivers']
+                self.care_workers_data = data['care_workers']
+                self.fitness_scales = dict(instance.metadata.get('fitness_scales', {}))
+                self.column_orders = {
+                    'care_receivers': instance.caregiver_ids[instance.recipient_columns].tolist(),
+                    'care_workers': instance.recipient_ids[instance.caregiver_columns].tolist(),
+                }
+                print(f"キャッシュから読み込みました: {cache_path}")
+                print(f"被介護者データを読み込みました: {len(self.care_receivers_data)}人")
+                print(f"ケアワーカーデータを読み込みました: {len(self.care_workers_data)}人")
+                return self.care_receivers_data, self.care_workers_data
+
+        with ThreadPoolExecutor(max_workers=len(paths) + 1) as executor:
+            matrix_futures = [executor.submit(self.read_matrix, path) for path in paths]
+            capacity_future = (executor.submit(self.read_capacities, worker_capacity_csv)
+                               if worker_capacity_csv else None)
+            matrices = [future.result() for future in matrix_futures]
+            capacities = capacity_future.result() if capacity_future else {}
+
+        self.care_receivers_data = self._build_group_data(
+            matrices[0], matrices[1], receiver_subjective_csv, receiver_objective_csv,
+            'care_receivers'
+        )
+        self.care_workers_data = self._build_group_data(
+            matrices[2], matrices[3], worker_subjective_csv, worker_objective_csv,
+            'care_workers'
+        )
+        for worker_id, data in self.care_workers_data.items():
+            data['capacity'] = capacities.get(worker_id, default_capacity)
+        if cache_path is not None:
+            try:
+                MatchingInstance.from_csv_data(
+                    self.care_receivers_data, self.care_workers_data,
+                    self.fitness_scales, self.column_orders
+                ).save(cache_path)
+            except ConstraintViolationError:
+                pass  # ID が揃っていないデータはキャッシュしない（validate_data_consistency で報告）
+        print(f"被介護者データを読み込みました: {len(self.care_receivers_data)}人")
+        print(f"ケアワーカーデータを読み込みました: {len(self.care_workers_data)}人")
+        return self.care_receivers_data, self.care_workers_data
+
+    @classmethod
+    def content_hash(cls, paths: List[Optional[str]], default_capacity: int = 1) -> str:
+        """
+        入力ファイルの内容（と読み込み設定）の SHA-256 をキャッシュのキーとして返す
+
+        ファイル名や更新日時ではなく内容で判定するため、同じ内容のファイルを
+        別の場所から読み込んでもキャッシュが使われる。
+        """
+        digest = hashlib.sha256()
+        digest.update(f"v{MatchingInstance.FORMAT_VERSION}:scale{cls.FITNESS_SCALE}:"
+                      f"{default_capacity}".encode())
+        for path in paths:
+            if path is None:
+                digest.update(b"\0none")
+                continue
+            with open(path, 'rb') as f:
+                content = f.read()
+            digest.update(len(content).to_bytes(8, 'little'))
+            digest.update(content)
+        return digest.hexdigest()
+
+    def validate_data_consistency(self) -> bool:
+        """
+        読み込んだデータの ID 整合性と制約をチェック
+
+        - 被介護者の候補（列）とケアワーカー（行）、ケアワーカーの候補と被介護者が一致すること
+        - 各エージェントのランキングとフィット度が同じ候補者を対象にしていること
+        - 人数・容量・フィット度の制約（validation.py）を満たすこと
+
+        Raises:
+            ConstraintViolationError: 不整合や制約違反がある場合
+        """
+        receiver_ids = list(self.care_receivers_data)
+        worker_ids = list(self.care_workers_data)
+        InputValidator.validate_participant_count(receiver_ids, worker_ids)
+
+        for agents, others, label in ((self.care_receivers_data, set(worker_ids), "被介護者"),
+                                      (self.care_workers_data, set(receiver_ids), "ケアワーカー")):
+            for agent_id, data in agents.items():
+                candidates = list(data['subjective_preferences'])
+                unknown = set(candidates) - others
+                if unknown:
+                    raise ConstraintViolationError(
+                        f"{label}{agent_id}の選好に存在しないIDがあります: {sorted(unknown)}"
+                    )
+                if set(data['objective_fitness']) != set(candidates):
+                    raise ConstraintViolationError(
+                        f"{label}{agent_id}のランキングとフィット度の対象が一致しません"
+                    )
+                fitness_scores = [data['objective_fitness'][c] for c in candidates]
+                InputValidator.validate_fitness_scores_are_integers(fitness_scores)
+                InputValidator.validate_fitness_uniqueness(fitness_scores, f"{label}{agent_id}")
+
+        InputValidator.validate_capacity_constraints(
+            worker_ids, {w: data['capacity'] for w, data in self.care_workers_data.items()}
+        )
+        print("データ整合性チェック: OK")
+        return True
+
+    def create_sample_csv_files(self, directory: str = ".") -> List[str]:
+        """
+        CSV_INPUT_GUIDE.md の例と同じ内容のサンプルCSVファイルを作成
+
+        Returns:
+            List[str]: 作成したファイルのパス
+        """
+        os.makedirs(directory, exist_ok=True)
+        paths = []
+        for filename, rows in self.SAMPLE_FILES.items():
+            path = os.path.join(directory, filename)
+            with open(path, 'w', encoding='utf-8', newline='') as f:
+                csv.writer(f).writerows(rows)
+            paths.append(path)
+        print(f"サンプルCSVファイルを作成しました: {', '.join(paths)}")
+        return paths
@@ -9,12 +9,17 @@ from deferred_acceptance import DeferredAcceptanceAlgorithm
 import json
 import os
 from typing import Dict, List, Optional
+import numpy as np
 
 class CSVMatchingSystem:
     """CSV入力対応のマッチングシステム"""
     
-    def __init__(self):
-        self.csv_handler = CSVInputHandler()
+    def __init__(self, csv_cache_dir: Optional[str] = None):
+        """
+        Args:
+            csv_cache_dir: CSV の解析結果のキャッシュを置くディレクトリ（None ならキャッシュしない）
+        """
+        self.csv_handler = CSVInputHandler(cache_dir=csv_cache_dir)
         self.kemeny_rule = ExtendedKemenyRule()
         self.da_algorithm = DeferredAcceptanceAlgorithm()
         
@@ -41,13 +46,9 @@ class CSVMatchingSystem:
         """
         print("=== CSVデータ読み込み開始 ===")
         
-        # 被介護者データの読み込み
-        self.care_receivers_data = self.csv_handler.load_care_receivers_data(
-            receiver_subjective_csv, receiver_objective_csv
-        )
-        
-        # ケアワーカーデータの読み込み
-        self.care_workers_data = self.csv_handler.load_care_workers_data(
+        # 被介護者・ケアワーカーのCSVを並行して読み込む
+        self.care_receivers_data, self.care_workers_data = self.csv_handler.load_all_data(
+            receiver_subjective_csv, receiver_objective_csv,
             worker_subjective_csv, worker_objective_csv, worker_capacity_csv
         )
         
@@ -76,37 +77,15 @@ class CSVMatchingSystem:
         
         # 被介護者の選好統合
         print("\n被介護者の選好統合中...")
-        for receiver_id, data in self.care_receivers_data.items():
-            candidates = list(data['subjective_preferences'].keys())
-            subjective_prefs = data['subjective_preferences']
-            objective_fitness = data['objective_fitness']
-            
-            integrated_ranking = self.kemeny_rule.aggregate_preferences(
-                candidates, subjective_prefs, objective_fitness
-            )
-            
-            # タプルの場合、ランキングリストのみを取得
-            if isinstance(integrated_ranking, tuple):
-                self.integrated_preferences['care_receivers'][receiver_id] = integrated_ranking[0]
-            else:
-                self.integrated_preferences['care_receivers'][receiver_id] = integrated_ranking
+        self.integrated_preferences['care_receivers'] = self._aggregate_group(
+            self.care_receivers_data
+        )
         
         # ケアワーカーの選好統合
         print("\nケアワーカーの選好統合中...")
-        for worker_id, data in self.care_workers_data.items():
-            candidates = list(data['subjective_preferences'].keys())
-            subjective_prefs = data['subjective_preferences']
-            objective_fitness = data['objective_fitness']
-            
-            integrated_ranking = self.kemeny_rule.aggregate_preferences(
-                candidates, subjective_prefs, objective_fitness
-            )
-            
-            # タプルの場合、ランキングリストのみを取得
-            if isinstance(integrated_ranking, tuple):
-                self.integrated_preferences['care_workers'][worker_id] = integrated_ranking[0]
-            else:
-                self.integrated_preferences['care_workers'][worker_id] = integrated_ranking
+        self.integrated_preferences['care_workers'] = self._aggregate_group(
+            self.care_workers_data
+        )
         
         print("\n統合結果:")
         print("被介護者の統合選好:")
@@ -117,6 +96,50 @@ class CSVMatchingSystem:
         for worker_id, ranking in self.integrated_preferences['care_workers'].items():
             print(f"  ケアワーカー{worker_id}: {ranking}")
     
+    def _aggregate_group(self, agents_data: Dict) -> Dict:
+        """
+        エージェント群の選好を候補者集合ごとにまとめて一括統合
+        
+        Args:
+            agents_data: {エージェントID: {'subjective_preferences': {候補者ID: 順位},
+                                           'objective_fitness': {候補者ID: フィット度},
+                                           'preference_order': [候補者ID順]（省略可）}}
+        
+        Returns:
+            Dict: {エージェントID: 統合ランキング}（入力順）
+        """
+        # 候補者集合が同じエージェントをまとめ、aggregate_batch に1回で渡す
+        groups: Dict[tuple, List] = {}
+        for agent_id, data in agents_data.items():
+            candidates = tuple(data['subjective_preferences'].keys())
+            groups.setdefault(candidates, []).append(agent_id)
+        
+        integrated = {}
+        for candidates, agent_ids in groups.items():
+            # ExtendedKemenyRule はフィット度を候補者の値で参照するため、
+            # CSV の ID を 0..n-1 の連番に振り直して渡し、結果を ID に戻す
+            index_of = {c: i for i, c in enumerate(candidates)}
+            preferences = np.array([
+                [index_of[c] for c in (
+                    agents_data[a].get('preference_order') or
+                    sorted(candidates, key=lambda c: agents_data[a]['subjective_preferences'][c])
+                )]
+                for a in agent_ids
+            ], dtype=np.int64).reshape(len(agent_ids), len(candidates))
+            fitness = np.array([
+                [agents_data[a]['objective_fitness'][c] for c in candidates]
+                for a in agent_ids
+            ]).reshape(len(agent_ids), len(candidates))
+            rankings, _ = self.kemeny_rule.aggregate_batch(
+                preferences, fitness, list(range(len(candidates)))
+            )
+            integrated.update(
+                (agent_id, [candidates[i] for i in ranking])
+                for agent_id, ranking in zip(agent_ids, rankings)
+            )
+        
+        return {agent_id: integrated[agent_id] for agent_id in agents_data}
+    
     def run_matching(self):
         """
         DAアルゴリズムを使用してマッチングを実行
@@ -168,7 +191,7 @@ class CSVMatchingSystem:
         
         # 安定性チェック
         capacities = {worker_id: data['capacity'] for worker_id, data in self.care_workers_data.items()}
-        is_stable = self.da_algorithm.is_stable_matching(
+        is_stable, _ = self.da_algorithm.is_stable_matching(
             self.matching_result['matching'],
             self.integrated_preferences['care_receivers'],
             self.integrated_preferences['care_workers'],
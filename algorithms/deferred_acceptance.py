@@ -13,16 +13,39 @@ DAアルゴリズムは安定マッチングを生成する標準的なアルゴ
 Author: 倉持誠 (Makoto Kuramochi)
 """
 
-from typing import List, Dict, Tuple, Optional, Set
+from typing import List, Dict, Tuple, Optional, Set, Iterator, Union
+from array import array
+from collections import deque
 import copy
+import heapq
+import numpy as np
 from validation import InputValidator, ConstraintViolationError
 
 
 class DeferredAcceptanceAlgorithm:
     """Deferred Acceptance アルゴリズムの実装クラス"""
+
+    TRACE_LEVELS = ("none", "compact", "verbose")
+
+    # compact トレースのイベント種別
+    EVENT_PROPOSE = 0    # 被介護者が提案
+    EVENT_EXHAUSTED = 1  # 提案先がないため未マッチ確定（ケアワーカーは -1）
+    EVENT_ACCEPT = 2     # ケアワーカーが仮受入
+    EVENT_REJECT = 3     # ケアワーカーが拒否
     
-    def __init__(self):
-        """DAアルゴリズムの初期化"""
+    def __init__(self, trace: str = "verbose"):
+        """DAアルゴリズムの初期化
+
+        Args:
+            trace: マッチング過程の記録方法
+                - "verbose": ステップごとの状態と日本語のアクション文を history に記録（既定）
+                - "compact": (ステップ, 種別, 被介護者ID, ケアワーカーID) の整数4つ組を
+                  array に記録するだけ。print_matching_process が表示時に再構成する
+                - "none": 記録しない
+        """
+        if trace not in self.TRACE_LEVELS:
+            raise ValueError(f"trace は {self.TRACE_LEVELS} のいずれかを指定してください")
+        self.trace = trace
         self.history = []  # マッチング過程の履歴
     
     def create_match(self, 
@@ -41,99 +64,108 @@ class DeferredAcceptanceAlgorithm:
             caregiver_preferences: ケアワーカーの選好辞書 {ケアワーカーID: [被介護者ID順]}
             caregiver_capacities: ケアワーカーのキャパシティ辞書 {ケアワーカーID: 容量}
             
+        McVitie–Wilson 型の逐次 DA: 未マッチの被介護者の待ち行列から1人ずつ取り出して
+        次の希望先に提案させ、その場で選考する。各被介護者は選好リストの各要素に
+        高々1回しか提案しないため、提案回数は Σ|選好リスト| 以下で必ず終了する
+        被介護者側最適な安定マッチングは提案順序によらず一意なので、結果は常に
+        その安定マッチングになる。旧実装（同期ラウンド方式）は、提案したラウンドで
+        即座に拒否された被介護者を未マッチの集合から外してしまい以降の提案が
+        行われないこと、また100ステップで打ち切ることから、不安定なマッチングを
+        返すことがあった。その場合は旧実装と結果が異なる（本実装の安定な結果が正しい）。
+        履歴のステップ番号は「何回目の提案機会か」（ラウンド）を表す。
+        
         Returns:
             Tuple[Dict[int, int], Dict]: マッチング結果 {被介護者ID: ケアワーカーID} と詳細情報
+            （詳細情報の 'proposals' は提案回数、'rounds' はラウンド数）
         """
         # 初期化
         self.history = []
-        unmatched_recipients = set(care_recipients)
+        # 未マッチの被介護者の待ち行列 (被介護者ID, ラウンド)。拒否された被介護者は
+        # 次のラウンドとして末尾に戻るため、ラウンド番号は先頭から単調に増える
+        free_recipients = deque((r, 1) for r in dict.fromkeys(care_recipients))
         current_proposals = {r: 0 for r in care_recipients}  # 各被介護者の現在の提案先インデックス
-        tentative_matches = {c: [] for c in caregivers}  # ケアワーカーの仮マッチリスト
         final_matches = {}  # 最終マッチング結果
+
+        # 逆順位表を1度だけ作り、選考は list.index と全件ソートの代わりに
+        # (順位, ID) の最大ヒープで最下位の仮受入者を O(log 容量) で取り出す
+        rank_tables = self.build_rank_tables(caregiver_preferences)
+        held_heaps = {c: [] for c in caregivers}  # 要素は (-順位, -被介護者ID)
+        # 直近の容量超過以降に仮受入した被介護者（到着順）。旧実装の仮マッチリストは
+        # 容量超過のたびに選好順へ並べ替え、その後の受入は末尾に追加していたため、
+        # 並び順は「それ以前の受入者を選好順に並べたもの + 以降の到着順」で再現できる
+        arrivals = {c: [] for c in caregivers}
+
+        def held_list(caregiver: int) -> List[int]:
+            tail = arrivals[caregiver]
+            tail_set = set(tail)
+            head = sorted((-neg_rank, -neg_id) for neg_rank, neg_id in held_heaps[caregiver]
+                          if -neg_id not in tail_set)
+            return [r for _, r in head] + tail
+
+        verbose = self.trace == "verbose"
+        events = array('q') if self.trace == "compact" else None
+        n_proposals = 0
+        step = 0
         
-        step = 1
-        
-        while unmatched_recipients:
-            # 現在のステップの情報を記録
-            step_info = {
-                'step': step,
-                'unmatched_recipients': list(unmatched_recipients),
-                'current_proposals': copy.deepcopy(current_proposals),
-                'tentative_matches': copy.deepcopy(tentative_matches),
-                'actions': []
-            }
+        while free_recipients:
+            recipient, recipient_step = free_recipients.popleft()
+            if recipient_step != step:
+                # 新しいラウンドの開始: 待ち行列には今回のラウンドの被介護者だけが残っている
+                step = recipient_step
+                if verbose:
+                    step_info = {
+                        'step': step,
+                        'unmatched_recipients': [recipient] + [r for r, _ in free_recipients],
+                        'current_proposals': copy.deepcopy(current_proposals),
+                        'tentative_matches': {c: held_list(c) for c in caregivers},
+                        'actions': []
+                    }
+                    self.history.append(step_info)
+                    actions = step_info['actions']
             
-            # ステップ1: 未マッチの被介護者が提案
-            proposals_this_round = {}
-            for recipient in list(unmatched_recipients):
-                if current_proposals[recipient] < len(recipient_preferences[recipient]):
-                    target_caregiver = recipient_preferences[recipient][current_proposals[recipient]]
-                    proposals_this_round[recipient] = target_caregiver
-                    
-                    action = f"被介護者{recipient}がケアワーカー{target_caregiver}に提案"
-                    step_info['actions'].append(action)
-                    
-                    current_proposals[recipient] += 1
-                else:
-                    # 提案先がない場合は未マッチのまま
-                    unmatched_recipients.remove(recipient)
-                    action = f"被介護者{recipient}は提案先がないため未マッチ確定"
-                    step_info['actions'].append(action)
+            # 提案先がない場合は未マッチ確定
+            if current_proposals[recipient] >= len(recipient_preferences[recipient]):
+                if verbose:
+                    actions.append(f"被介護者{recipient}は提案先がないため未マッチ確定")
+                elif events is not None:
+                    events.extend((step, self.EVENT_EXHAUSTED, recipient, -1))
+                continue
             
-            # ステップ2: ケアワーカーが提案を評価
-            for recipient, caregiver in proposals_this_round.items():
-                # 現在の仮マッチリストに追加
-                tentative_matches[caregiver].append(recipient)
-                
-                # キャパシティを超えている場合は選考
-                if len(tentative_matches[caregiver]) > caregiver_capacities[caregiver]:
-                    # ケアワーカーの選好に基づいて選考
-                    candidates = tentative_matches[caregiver]
-                    # 選好順に並べ替え（選好が高い順）
-                    candidates_with_pref = []
-                    for candidate in candidates:
-                        if candidate in caregiver_preferences[caregiver]:
-                            pref_order = caregiver_preferences[caregiver].index(candidate)
-                            candidates_with_pref.append((pref_order, candidate))
-                        else:
-                            # 選好リストにない場合は最低優先度
-                            candidates_with_pref.append((len(caregiver_preferences[caregiver]), candidate))
-                    
-                    candidates_with_pref.sort()  # 選好順序でソート
-                    
-                    # キャパシティ分だけ仮受入
-                    accepted = [c for _, c in candidates_with_pref[:caregiver_capacities[caregiver]]]
-                    rejected = [c for _, c in candidates_with_pref[caregiver_capacities[caregiver]:]]
-                    
-                    tentative_matches[caregiver] = accepted
-                    
-                    # 拒否された被介護者を再び未マッチに
-                    for rej in rejected:
-                        unmatched_recipients.add(rej)
-                        action = f"ケアワーカー{caregiver}が被介護者{rej}を拒否"
-                        step_info['actions'].append(action)
-                    
-                    if accepted:
-                        action = f"ケアワーカー{caregiver}が{accepted}を仮受入"
-                        step_info['actions'].append(action)
-                else:
-                    # キャパシティ内なので受入
-                    action = f"ケアワーカー{caregiver}が被介護者{recipient}を仮受入"
-                    step_info['actions'].append(action)
-                
-                # 提案した被介護者を一旦マッチ済みに
-                if recipient in unmatched_recipients:
-                    unmatched_recipients.remove(recipient)
+            # 次の希望先に提案
+            caregiver = recipient_preferences[recipient][current_proposals[recipient]]
+            current_proposals[recipient] += 1
+            n_proposals += 1
+            if verbose:
+                actions.append(f"被介護者{recipient}がケアワーカー{caregiver}に提案")
+            elif events is not None:
+                events.extend((step, self.EVENT_PROPOSE, recipient, caregiver))
             
-            # ステップ履歴に追加
-            self.history.append(step_info)
-            step += 1
+            # 仮受入ヒープに追加（選好リストにない場合は最低優先度）
+            heap = held_heaps[caregiver]
+            rank = rank_tables[caregiver].get(recipient, len(caregiver_preferences[caregiver]))
+            heapq.heappush(heap, (-rank, -recipient))
+            arrivals[caregiver].append(recipient)
+            if events is not None:
+                events.extend((step, self.EVENT_ACCEPT, recipient, caregiver))
             
-            # 無限ループ防止
-            if step > 100:
-                break
+            # キャパシティを超えている場合は最下位（順位、同順位ならIDが最大）を拒否し、
+            # 次のラウンドの提案者として待ち行列に戻す
+            if len(heap) > caregiver_capacities[caregiver]:
+                rejected = -heapq.heappop(heap)[1]
+                arrivals[caregiver] = []
+                free_recipients.append((rejected, step + 1))
+                if verbose:
+                    actions.append(f"ケアワーカー{caregiver}が被介護者{rejected}を拒否")
+                    if heap:
+                        actions.append(f"ケアワーカー{caregiver}が{held_list(caregiver)}を仮受入")
+                elif events is not None:
+                    events.extend((step, self.EVENT_REJECT, rejected, caregiver))
+            elif verbose:
+                # キャパシティ内なので受入
+                actions.append(f"ケアワーカー{caregiver}が被介護者{recipient}を仮受入")
         
         # 最終マッチング結果を生成
+        tentative_matches = {c: held_list(c) for c in caregivers}
         for caregiver, recipients in tentative_matches.items():
             for recipient in recipients:
                 final_matches[recipient] = caregiver
@@ -141,15 +173,715 @@ class DeferredAcceptanceAlgorithm:
         # 詳細情報をまとめる
         details = {
             'final_matches': final_matches,
+            'trace': self.trace,
             'history': self.history,
             'unmatched_recipients': [r for r in care_recipients if r not in final_matches],
+            'proposals': n_proposals,
+            'rounds': step,
             'caregiver_utilization': {
                 c: len(tentative_matches[c]) for c in caregivers
             }
         }
+        if events is not None:
+            details['events'] = events
         
         return final_matches, details
+
+    def create_match_incremental(self,
+                                 care_recipients: List[int],
+                                 caregivers: List[int],
+                                 recipient_preferences: Dict[int, List[int]],
+                                 caregiver_preferences: Dict[int, List[int]],
+                                 caregiver_capacities: Dict[int, int],
+                                 previous_state: Optional[Dict] = None
+                                 ) -> Tuple[Dict[int, int], Dict, Dict]:
+        """前回のマッチング状態を再利用して、入力の変化の影響を受けた部分だけ DA を再開
+
+        previous_state（前回この関数が返した状態）と今回の入力を比較し、
+        ケアワーカーの容量変更・選好変更・追加・削除、被介護者の追加・削除・選好変更を
+        検出して、影響を受けた被介護者だけを提案の待ち行列に戻す。
+
+        - 容量の減少・ケアワーカーの削除: 超過分（全員）を拒否するだけでよい
+          （これまでの拒否はより厳しい条件でも成り立つ）
+        - 容量の増加・ケアワーカーの選好変更: そのケアワーカーを「再開」する。
+          再開したケアワーカーが過去に拒否した被介護者は、そのケアワーカー以降への
+          提案を全て取り消して提案位置を戻す。取り消した提案の提案先は、その提案が
+          過去の選考に影響した可能性があるため同様に再開し、連鎖させる
+        - 被介護者の削除・選好変更: その被介護者の全ての提案を取り消し（提案先を再開）、
+          選好変更なら提案位置を先頭にして待ち行列に加える。追加も同様
+
+        被介護者側最適な安定マッチングは提案順序によらず一意なので、結果
+        （被介護者とケアワーカーの組）は create_match を最初から実行した場合と同じになる。
+        提案回数は影響を受けた範囲に比例する（状態の複製と入力の比較は O(n + L)）。
+        previous_state が None なら全員を新規として通常の DA を実行する。
+        ケアワーカーを追加・削除する場合は、被介護者の選好リストも create_match と同様に
+        存在するケアワーカーだけを含むように更新すること。
+
+        Args:
+            care_recipients: 被介護者のIDリスト
+            caregivers: ケアワーカーのIDリスト
+            recipient_preferences: 被介護者の選好辞書 {被介護者ID: [ケアワーカーID順]}
+            caregiver_preferences: ケアワーカーの選好辞書 {ケアワーカーID: [被介護者ID順]}
+            caregiver_capacities: ケアワーカーのキャパシティ辞書 {ケアワーカーID: 容量}
+            previous_state: 前回の呼び出しが返した状態辞書（変更されない）
+
+        Returns:
+            Tuple[Dict[int, int], Dict, Dict]: マッチング結果、詳細情報、次回用の状態辞書
+            （詳細情報の 'proposals' は今回の提案回数、'displaced_recipients' は
+            待ち行列に戻した被介護者数）
+        """
+        if previous_state is None:
+            previous_state = {
+                'recipient_preferences': {}, 'caregiver_preferences': {},
+                'caregiver_capacities': {}, 'recipient_positions': {}, 'rank_tables': {},
+                'pointers': {}, 'partner': {}, 'held': {}, 'heaps': {}, 'rejected_by': {}
+            }
+        old_recipient_preferences = previous_state['recipient_preferences']
+        old_caregiver_preferences = previous_state['caregiver_preferences']
+        old_capacities = previous_state['caregiver_capacities']
+        recipient_positions = dict(previous_state['recipient_positions'])  # 被介護者 → {ケアワーカー: 最初の位置}
+        rank_tables = dict(previous_state['rank_tables'])
+        pointers = dict(previous_state['pointers'])
+        partner = dict(previous_state['partner'])
+        held = {c: set(rs) for c, rs in previous_state['held'].items()}
+        heaps = {c: list(h) for c, h in previous_state['heaps'].items()}
+        rejected_by = {c: set(rs) for c, rs in previous_state['rejected_by'].items()}
+
+        recipients = list(dict.fromkeys(care_recipients))
+        recipient_set = set(recipients)
+        caregiver_set = set(caregivers)
+        free_recipients = deque()
+        queued: Set[int] = set()
+        reopened = deque()
+
+        def key(caregiver: int, recipient: int) -> Tuple[int, int]:
+            # create_match と同じ比較: 選好リスト外は最低優先度、同順位なら ID の小さい方を優先
+            return (rank_tables[caregiver].get(recipient, len(caregiver_preferences[caregiver])),
+                    recipient)
+
+        def enqueue(recipient: int):
+            if recipient not in queued:
+                queued.add(recipient)
+                free_recipients.append(recipient)
+
+        def undo_proposals(recipient: int, start: int):
+            # 選好リストの start 以降への提案を取り消す。提案先は過去の選考が
+            # この提案に影響された可能性があるため、全て再開（reopened）の対象にする
+            prefs = old_recipient_preferences.get(recipient, ())
+            positions = recipient_positions[recipient]
+            caregiver = partner.pop(recipient, None)
+            if caregiver is not None and caregiver in held:
+                held[caregiver].discard(recipient)
+            for caregiver in prefs[start:pointers[recipient]]:
+                reopened.append(caregiver)
+                # start より前にも現れるケアワーカー（選好リストの重複）の拒否は残す
+                if caregiver in rejected_by and positions[caregiver] >= start:
+                    rejected_by[caregiver].discard(recipient)
+            pointers[recipient] = start
+
+        def reject_worst(caregiver: int) -> int:
+            # 遅延削除のヒープから、現在も仮受入中の最下位の被介護者を取り出す
+            heap = heaps[caregiver]
+            while True:
+                recipient = -heapq.heappop(heap)[1]
+                if recipient in held[caregiver]:
+                    held[caregiver].discard(recipient)
+                    del partner[recipient]
+                    rejected_by[caregiver].add(recipient)
+                    enqueue(recipient)
+                    return recipient
+
+        # 削除されたケアワーカー: 仮受入者は拒否されたのと同じ扱いで次の希望先へ進む
+        for caregiver in [c for c in held if c not in caregiver_set]:
+            for recipient in held[caregiver]:
+                partner.pop(recipient, None)
+                if recipient in recipient_set:
+                    enqueue(recipient)
+            for table in (held, heaps, rejected_by, rank_tables):
+                del table[caregiver]
+
+        # 削除された被介護者・選好が変わった被介護者: 全ての提案を取り消す
+        for recipient in list(pointers):
+            prefs = recipient_preferences.get(recipient) if recipient in recipient_set else None
+            if prefs is not None and prefs == old_recipient_preferences[recipient]:
+                continue
+            undo_proposals(recipient, 0)
+            del pointers[recipient]
+            del recipient_positions[recipient]
+        for recipient in recipients:
+            if recipient not in pointers:
+                pointers[recipient] = 0
+                recipient_positions[recipient] = self.build_rank_tables(
+                    {recipient: recipient_preferences[recipient]})[recipient]
+                enqueue(recipient)
+
+        # 追加・選好変更・容量変更のあったケアワーカー
+        for caregiver in caregivers:
+            if caregiver not in held:
+                held[caregiver] = set()
+                heaps[caregiver] = []
+                rejected_by[caregiver] = set()
+                rank_tables[caregiver] = self.build_rank_tables(
+                    {caregiver: caregiver_preferences[caregiver]})[caregiver]
+            elif caregiver_preferences[caregiver] != old_caregiver_preferences[caregiver]:
+                rank_tables[caregiver] = self.build_rank_tables(
+                    {caregiver: caregiver_preferences[caregiver]})[caregiver]
+                heaps[caregiver] = [(-rank, -r) for rank, r in
+                                    (key(caregiver, r) for r in held[caregiver])]
+                heapq.heapify(heaps[caregiver])
+                reopened.append(caregiver)
+            elif caregiver_capacities[caregiver] > old_capacities[caregiver]:
+                reopened.append(caregiver)
+
+        # 拒否の取り消しの連鎖: 再開するケアワーカーが過去に拒否した被介護者は
+        # そのケアワーカー以降への提案を取り消して戻し、その提案先も再開する
+        reopened_set: Set[int] = set()
+        while reopened:
+            caregiver = reopened.popleft()
+            if caregiver in reopened_set:
+                continue
+            reopened_set.add(caregiver)
+            for recipient in list(rejected_by.get(caregiver, ())):
+                undo_proposals(recipient, recipient_positions[recipient][caregiver])
+                enqueue(recipient)
+
+        for caregiver in caregivers:
+            while len(held[caregiver]) > caregiver_capacities[caregiver]:
+                reject_worst(caregiver)
+
+        displaced = len(free_recipients)
+        n_proposals = 0
+        while free_recipients:
+            recipient = free_recipients.popleft()
+            queued.discard(recipient)
+            prefs = recipient_preferences[recipient]
+            if pointers[recipient] >= len(prefs):
+                continue
+            caregiver = prefs[pointers[recipient]]
+            pointers[recipient] += 1
+            n_proposals += 1
+            partner[recipient] = caregiver
+            held[caregiver].add(recipient)
+            rank, _ = key(caregiver, recipient)
+            heapq.heappush(heaps[caregiver], (-rank, -recipient))
+            if len(held[caregiver]) > caregiver_capacities[caregiver]:
+                reject_worst(caregiver)
+
+        final_matches = {r: partner[r] for r in recipients if r in partner}
+        details = {
+            'final_matches': final_matches,
+            'unmatched_recipients': [r for r in recipients if r not in partner],
+            'proposals': n_proposals,
+            'displaced_recipients': displaced,
+            'caregiver_utilization': {c: len(held[c]) for c in caregivers}
+        }
+        state = {
+            'recipient_preferences': {r: list(recipient_preferences[r]) for r in recipients},
+            'caregiver_preferences': {c: list(caregiver_preferences[c]) for c in caregivers},
+            'caregiver_capacities': {c: caregiver_capacities[c] for c in caregivers},
+            'recipient_positions': recipient_positions,
+            'rank_tables': rank_tables,
+            'pointers': pointers,
+            'partner': partner,
+            'held': held,
+            'heaps': heaps,
+            'rejected_by': rejected_by
+        }
+        return final_matches, details, state
+
+    @staticmethod
+    def build_rank_tables(preferences: Dict[int, List[int]]) -> Dict[int, Dict[int, int]]:
+        """選好リストの逆順位表 {エージェントID: {相手ID: 順位(0始まり)}} を作成
+
+        list.index と同じく、同じ相手が複数回現れる場合は最初の位置を順位とする。
+        """
+        tables = {}
+        for agent, prefs in preferences.items():
+            table = {}
+            for position, other in enumerate(prefs):
+                table.setdefault(other, position)
+            tables[agent] = table
+        return tables
     
+    @staticmethod
+    def encode_preferences(care_recipients: List[int],
+                           caregivers: List[int],
+                           recipient_preferences: Dict[int, List[int]],
+                           caregiver_preferences: Dict[int, List[int]],
+                           caregiver_capacities: Dict[int, int]
+                           ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """辞書形式の入力を create_match_arrays 用の密な配列に変換（ID→インデックスは1度だけ）
+
+        被介護者・ケアワーカーは引数の並び順でインデックス化する。
+        選好リストにない被介護者の順位は create_match と同じく
+        「リスト長 + ID の昇順位」とし、最低優先度かつ ID の小さい方を優先する。
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray, np.ndarray]:
+                recipient_preferences (被介護者数 × 最大リスト長, int32, 不足分は -1)、
+                caregiver_ranks (ケアワーカー数 × 被介護者数, int32)、
+                capacities (ケアワーカー数, int32)
+        """
+        recipient_index = {r: i for i, r in enumerate(care_recipients)}
+        caregiver_index = {c: j for j, c in enumerate(caregivers)}
+        n_recipients = len(care_recipients)
+
+        width = max((len(recipient_preferences[r]) for r in care_recipients), default=0)
+        preference_array = np.full((n_recipients, width), -1, dtype=np.int32)
+        for i, r in enumerate(care_recipients):
+            prefs = recipient_preferences[r]
+            preference_array[i, :len(prefs)] = [caregiver_index[c] for c in prefs]
+
+        id_order = np.empty(n_recipients, dtype=np.int64)
+        id_order[np.argsort(np.asarray(care_recipients), kind='stable')] = np.arange(n_recipients)
+        rank_array = np.empty((len(caregivers), n_recipients), dtype=np.int32)
+        for j, c in enumerate(caregivers):
+            prefs = caregiver_preferences[c]
+            rank_array[j] = len(prefs) + id_order
+            # list.index と同じく最初の出現位置を順位にするため後ろから書き込む
+            for position in range(len(prefs) - 1, -1, -1):
+                if prefs[position] in recipient_index:
+                    rank_array[j, recipient_index[prefs[position]]] = position
+
+        capacity_array = np.asarray([caregiver_capacities[c] for c in caregivers], dtype=np.int32)
+        return preference_array, rank_array, capacity_array
+
+    @staticmethod
+    def decode_matches(matches: np.ndarray, care_recipients: List[int],
+                       caregivers: List[int]) -> Dict[int, int]:
+        """create_match_arrays の結果（ケアワーカーのインデックス、未マッチは -1）を ID の辞書に戻す"""
+        return {care_recipients[i]: caregivers[j]
+                for i, j in enumerate(np.asarray(matches).tolist()) if j >= 0}
+
+    def create_match_arrays(self,
+                            recipient_preferences: np.ndarray,
+                            caregiver_ranks: np.ndarray,
+                            capacities: np.ndarray) -> Tuple[np.ndarray, Dict]:
+        """密な配列で表した市場に DA を適用（被介護者側最適な安定マッチング）
+
+        create_match と同じマッチングを、辞書やリストを確保せず NumPy の
+        ラウンド単位の一括処理で求める。各ラウンドで未マッチの被介護者が一斉に
+        次の希望先へ提案し、提案を受けたケアワーカーごとに (順位, インデックス) で
+        並べて容量を超えた分を拒否する。
+
+        Args:
+            recipient_preferences: shape = (被介護者数, L) のケアワーカーインデックス
+                （選好順、リスト長が L 未満の行は末尾を -1 で埋める。int16/int32 など）
+            caregiver_ranks: shape = (ケアワーカー数, 被介護者数) の順位（小さいほど優先、
+                同順位はインデックスの小さい方を優先）
+            capacities: shape = (ケアワーカー数,) の容量
+
+        Returns:
+            Tuple[np.ndarray, Dict]: 各被介護者のケアワーカーインデックス（未マッチは -1）と
+            詳細情報 {'proposals': 提案回数, 'rounds': ラウンド数}
+        """
+        preferences = np.asarray(recipient_preferences)
+        ranks = np.asarray(caregiver_ranks)
+        capacity_array = np.asarray(capacities)
+        if preferences.ndim != 2 or ranks.ndim != 2 or capacity_array.ndim != 1:
+            raise ValueError("選好は2次元、順位は2次元、容量は1次元の配列で指定してください")
+        if ranks.shape != (capacity_array.shape[0], preferences.shape[0]):
+            raise ValueError("順位配列の形状は (ケアワーカー数, 被介護者数) にしてください")
+
+        matches, proposals, rounds = self._deferred_acceptance_arrays(
+            preferences, ranks, capacity_array, preferences.shape[0]
+        )
+        return matches, {'proposals': int(proposals.sum()), 'rounds': rounds}
+
+    def create_match_batch(self,
+                           recipient_preferences: np.ndarray,
+                           caregiver_ranks: np.ndarray,
+                           capacities: np.ndarray) -> Tuple[np.ndarray, Dict]:
+        """独立した複数の市場（モンテカルロ試行など）をまとめて DA で解く
+
+        インスタンス b の被介護者 i とケアワーカー j を通し番号 b・R + i、b・C + j に
+        振り直すと、全インスタンスは互いに提案し合わない1つの大きな市場になるため、
+        create_match_arrays と同じ一括処理を1回行うだけで全インスタンスが解ける。
+
+        Args:
+            recipient_preferences: shape = (インスタンス数, 被介護者数, L)
+            caregiver_ranks: shape = (インスタンス数, ケアワーカー数, 被介護者数)
+            capacities: shape = (インスタンス数, ケアワーカー数) または (ケアワーカー数,)
+
+        Returns:
+            Tuple[np.ndarray, Dict]: shape = (インスタンス数, 被介護者数) のマッチングと
+            詳細情報 {'proposals': インスタンスごとの提案回数, 'rounds': 最大ラウンド数}
+        """
+        preferences = np.asarray(recipient_preferences)
+        ranks = np.asarray(caregiver_ranks)
+        if preferences.ndim != 3 or ranks.ndim != 3:
+            raise ValueError("選好と順位は3次元配列で指定してください")
+        n_instances, n_recipients, width = preferences.shape
+        n_caregivers = ranks.shape[1]
+        if ranks.shape != (n_instances, n_caregivers, n_recipients):
+            raise ValueError("順位配列の形状は (インスタンス数, ケアワーカー数, 被介護者数) にしてください")
+        capacity_array = np.broadcast_to(np.asarray(capacities), (n_instances, n_caregivers))
+        if width == 0:
+            # 選好リストが空（ケアワーカーなし）なら提案は起きず、全員が未マッチ
+            return np.full((n_instances, n_recipients), -1, dtype=np.int64), {
+                'proposals': np.zeros(n_instances, dtype=np.int64),
+                'rounds': 0
+            }
+
+        # ケアワーカーのインデックスをインスタンスごとにずらして1つの市場にする
+        offsets = (np.arange(n_instances) * n_caregivers)[:, None, None]
+        flat_preferences = np.where(preferences >= 0, preferences + offsets, -1).reshape(
+            n_instances * n_recipients, width
+        )
+        matches, proposals, rounds = self._deferred_acceptance_arrays(
+            flat_preferences, ranks.reshape(n_instances * n_caregivers, n_recipients),
+            capacity_array.reshape(-1), n_recipients
+        )
+        matches = matches.reshape(n_instances, n_recipients)
+        matches = np.where(matches >= 0, matches - offsets[:, :, 0], -1)
+        return matches, {
+            'proposals': proposals.reshape(n_instances, n_recipients).sum(axis=1),
+            'rounds': rounds
+        }
+
+    @staticmethod
+    def _deferred_acceptance_arrays(preferences: np.ndarray, ranks: np.ndarray,
+                                    capacities: np.ndarray,
+                                    n_local_recipients: int) -> Tuple[np.ndarray, np.ndarray, int]:
+        """ラウンド単位の一括 DA の本体
+
+        ranks[g, i % n_local_recipients] が被介護者 i に対するケアワーカー g の順位
+        （バッチではインスタンスごとに被介護者番号が n_local_recipients ずつずれる）。
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray, int]: マッチング、被介護者ごとの提案回数、ラウンド数
+        """
+        n_recipients, width = preferences.shape
+        list_lengths = (preferences >= 0).sum(axis=1)
+        matches = np.full(n_recipients, -1, dtype=np.int64)
+        next_choice = np.zeros(n_recipients, dtype=np.int64)
+        active = list_lengths > 0
+        rounds = 0
+
+        while True:
+            proposers = np.flatnonzero(active & (matches < 0))
+            exhausted = next_choice[proposers] >= list_lengths[proposers]
+            active[proposers[exhausted]] = False
+            proposers = proposers[~exhausted]
+            if proposers.size == 0:
+                break
+            rounds += 1
+            targets = preferences[proposers, next_choice[proposers]].astype(np.int64)
+            next_choice[proposers] += 1
+            matches[proposers] = targets
+
+            # 提案を受けたケアワーカーの仮受入者（今回の提案者を含む）を順位順に並べ、
+            # 容量を超えた分を拒否する
+            touched = np.zeros(capacities.shape[0], dtype=bool)
+            touched[targets] = True
+            members = np.flatnonzero(matches >= 0)
+            members = members[touched[matches[members]]]
+            groups = matches[members]
+            member_ranks = ranks[groups, members % n_local_recipients]
+            order = np.lexsort((members, member_ranks, groups))
+            sorted_groups = groups[order]
+            positions = np.arange(order.size) - np.searchsorted(sorted_groups, sorted_groups)
+            rejected = members[order[positions >= capacities[sorted_groups]]]
+            matches[rejected] = -1
+
+        return matches, next_choice, rounds
+
+    @classmethod
+    def caregiver_rank_function(cls, care_recipients: List[int],
+                                caregiver_preferences: Dict[int, List[int]]):
+        """create_match と同じ規則のケアワーカー側順位 rank(caregiver, recipient) を返す
+
+        選好リストにある被介護者は最初の出現位置、ない被介護者は
+        「リスト長 + ID の昇順位」（最低優先度、同士は ID の小さい方を優先）。
+        """
+        rank_tables = cls.build_rank_tables(caregiver_preferences)
+        id_position = {r: i for i, r in enumerate(sorted(set(care_recipients)))}
+
+        def rank(caregiver: int, recipient: int) -> int:
+            position = rank_tables.get(caregiver, {}).get(recipient)
+            if position is None:
+                return len(caregiver_preferences.get(caregiver, ())) + id_position[recipient]
+            return position
+        return rank
+
+    def create_match_caregiver_proposing(self,
+                                         care_recipients: List[int],
+                                         caregivers: List[int],
+                                         recipient_preferences: Dict[int, List[int]],
+                                         caregiver_preferences: Dict[int, List[int]],
+                                         caregiver_capacities: Dict[int, int]
+                                         ) -> Tuple[Dict[int, int], Dict]:
+        """ケアワーカー提案型 DA でケアワーカー側最適な安定マッチングを生成
+
+        空き容量のあるケアワーカーを待ち行列から取り出し、選好順に次の被介護者へ
+        提案させる。被介護者は選好リストにあるケアワーカーのうち最も好ましい1人を
+        仮受入し、乗り換えられたケアワーカーは待ち行列に戻る。ケアワーカーの
+        選好順は create_match と同じ規則（caregiver_rank_function）で、提案先は
+        そのケアワーカーを選好リストに含む被介護者に限る。
+
+        Returns:
+            Tuple[Dict[int, int], Dict]: マッチング結果 {被介護者ID: ケアワーカーID} と詳細情報
+        """
+        recipient_ranks = self.build_rank_tables(recipient_preferences)
+        rank = self.caregiver_rank_function(care_recipients, caregiver_preferences)
+
+        # 提案先リスト: ケアワーカーを受け入れ得る被介護者をケアワーカーの選好順に並べる
+        offer_lists: Dict[int, List[int]] = {c: [] for c in caregivers}
+        for r in care_recipients:
+            for c in recipient_ranks[r]:
+                if c in offer_lists:
+                    offer_lists[c].append(r)
+        for c in caregivers:
+            offer_lists[c].sort(key=lambda r: rank(c, r))
+
+        next_offer = {c: 0 for c in caregivers}
+        held_count = {c: 0 for c in caregivers}
+        partner: Dict[int, int] = {}
+        free_caregivers = deque(caregivers)
+        n_proposals = 0
+        while free_caregivers:
+            caregiver = free_caregivers.popleft()
+            offers = offer_lists[caregiver]
+            while (held_count[caregiver] < caregiver_capacities[caregiver] and
+                   next_offer[caregiver] < len(offers)):
+                recipient = offers[next_offer[caregiver]]
+                next_offer[caregiver] += 1
+                n_proposals += 1
+                current = partner.get(recipient)
+                if current is not None and recipient_ranks[recipient][current] < recipient_ranks[recipient][caregiver]:
+                    continue  # 被介護者は現在の相手の方を好むため拒否
+                partner[recipient] = caregiver
+                held_count[caregiver] += 1
+                if current is not None:
+                    held_count[current] -= 1
+                    free_caregivers.append(current)
+
+        final_matches = {r: partner[r] for r in care_recipients if r in partner}
+        details = {
+            'final_matches': final_matches,
+            'unmatched_recipients': [r for r in care_recipients if r not in final_matches],
+            'proposals': n_proposals,
+            'caregiver_utilization': held_count
+        }
+        return final_matches, details
+
+    def stable_matching_lattice(self,
+                                care_recipients: List[int],
+                                caregivers: List[int],
+                                recipient_preferences: Dict[int, List[int]],
+                                caregiver_preferences: Dict[int, List[int]],
+                                caregiver_capacities: Dict[int, int]) -> Dict:
+        """安定マッチング全体の束をローテーション半順序として求める
+
+        被介護者側最適（create_match）とケアワーカー側最適
+        （create_match_caregiver_proposing）の2つの端点を求めたあと、
+        ケアワーカーを容量分の複製（被介護者からは c_1 > c_2 > ... の順に見える）に
+        分けた1対1の問題で、被介護者側最適から順にローテーションを除去して
+        ケアワーカー側最適に至るまでの全ローテーションを Gusfield の方法で求める。
+        各被介護者の選好リスト上のポインタは後退しないため、端点を求めた後の
+        計算量は O(L log n)（L = 複製後の選好リスト長の総和）。
+        安定マッチングはローテーション半順序の閉集合（下方集合）と1対1に対応するため、
+        iter_stable_matchings / count_stable_matchings で全列挙・数え上げができる。
+
+        Returns:
+            Dict: 'recipient_optimal' / 'caregiver_optimal'（両端のマッチング）、
+                'rotations'（各ローテーションの (被介護者ID, 元のケアワーカーID,
+                移動先のケアワーカーID) のリスト、除去可能な順）、
+                'predecessors'（各ローテーションの直前に除去が必要なローテーション番号）
+        """
+        recipient_optimal, _ = DeferredAcceptanceAlgorithm("none").create_match(
+            care_recipients, caregivers, recipient_preferences,
+            caregiver_preferences, caregiver_capacities
+        )
+        caregiver_optimal, _ = self.create_match_caregiver_proposing(
+            care_recipients, caregivers, recipient_preferences,
+            caregiver_preferences, caregiver_capacities
+        )
+        rank = self.caregiver_rank_function(care_recipients, caregiver_preferences)
+        recipient_ranks = self.build_rank_tables(recipient_preferences)
+
+        # 複製 (ケアワーカー, k) を女性側の番号に割り当てる。どの安定マッチングでも
+        # 各ケアワーカーの受入数は同じ（Rural Hospitals 定理）なので、使われる複製だけを作る
+        utilization: Dict[int, int] = {}
+        for c in recipient_optimal.values():
+            utilization[c] = utilization.get(c, 0) + 1
+        clone_ids: Dict[int, List[int]] = {}
+        clone_caregiver: List[int] = []
+        for c in caregivers:
+            clone_ids[c] = list(range(len(clone_caregiver), len(clone_caregiver) + utilization.get(c, 0)))
+            clone_caregiver.extend([c] * utilization.get(c, 0))
+
+        def clone_partners(matching: Dict[int, int]) -> Dict[int, int]:
+            # 各ケアワーカーの受入者を選好順に c_1, c_2, ... へ割り当てる
+            assigned: Dict[int, List[int]] = {}
+            for r, c in matching.items():
+                assigned.setdefault(c, []).append(r)
+            partners = {}
+            for c, rs in assigned.items():
+                for clone, r in zip(clone_ids[c], sorted(rs, key=lambda r: rank(c, r))):
+                    partners[r] = clone
+            return partners
+
+        men = [r for r in care_recipients if r in recipient_optimal]
+        man_lists = {
+            r: [clone for c in recipient_ranks[r] if c in clone_ids for clone in clone_ids[c]]
+            for r in men
+        }
+        start = clone_partners(recipient_optimal)
+        end = clone_partners(caregiver_optimal)
+        current = dict(start)                       # 被介護者 → 複製
+        holder = {w: r for r, w in current.items()}  # 複製 → 被介護者
+        position = {r: man_lists[r].index(current[r]) for r in men}
+        end_position = {r: man_lists[r].index(end[r]) for r in men}
+        pointer = {r: position[r] + 1 for r in men}
+
+        def woman_rank(w: int, r: int) -> int:
+            return rank(clone_caregiver[w], r)
+
+        def next_woman(r: int) -> int:
+            # s(r): 現在の相手より後ろで、r を今の相手より好む最初の複製
+            # （複製側の相手は改善する一方なので、一度外れた複製は二度と該当しない）
+            while pointer[r] <= end_position[r]:
+                w = man_lists[r][pointer[r]]
+                if woman_rank(w, r) < woman_rank(w, holder[w]):
+                    return w
+                pointer[r] += 1
+            raise RuntimeError("ローテーションの探索に失敗しました")
+
+        rotations: List[List[Tuple[int, int, int]]] = []
+        clone_rotations: List[List[Tuple[int, int, int]]] = []
+        moved_to_by: Dict[Tuple[int, int], int] = {}
+        # 複製ごとの相手の変化 (ローテーション番号, 変化後の相手の順位, 変化前の相手の順位)
+        woman_history: Dict[int, List[Tuple[int, int, int]]] = {}
+        stack: List[int] = []
+        on_stack: Set[int] = set()
+        successor: Dict[int, int] = {}
+        for first in men:
+            while current[first] != end[first]:
+                if not stack:
+                    stack.append(first)
+                    on_stack.add(first)
+                top = stack[-1]
+                w = next_woman(top)
+                successor[top] = w
+                following = holder[w]
+                if following not in on_stack:
+                    stack.append(following)
+                    on_stack.add(following)
+                    continue
+                # スタック上の閉路 = 露出したローテーション。除去して探索を続ける
+                cycle = []
+                while True:
+                    r = stack.pop()
+                    on_stack.discard(r)
+                    cycle.append(r)
+                    if r == following:
+                        break
+                cycle.reverse()
+                index = len(clone_rotations)
+                moves = [(r, current[r], successor[r]) for r in cycle]
+                for r, old, new in moves:
+                    woman_history.setdefault(new, []).append(
+                        (index, woman_rank(new, r), woman_rank(new, holder[new]))
+                    )
+                for r, old, new in moves:
+                    current[r] = new
+                    holder[new] = r
+                    position[r] = pointer[r]
+                    pointer[r] += 1
+                    moved_to_by[(r, new)] = index
+                clone_rotations.append(moves)
+                rotations.append([(r, clone_caregiver[old], clone_caregiver[new])
+                                  for r, old, new in moves
+                                  if clone_caregiver[old] != clone_caregiver[new]])
+
+        # 先行関係: (a) ρ が r を w から動かすなら、r を w へ動かしたローテーションが先、
+        # (b) r のリストで w_i と w_{i+1} の間にある複製 w について、w の相手を
+        #     r より好ましい相手へ変えたローテーションが先
+        predecessors: List[Set[int]] = [set() for _ in clone_rotations]
+        for index, moves in enumerate(clone_rotations):
+            for r, old, new in moves:
+                if (r, old) in moved_to_by:
+                    predecessors[index].add(moved_to_by[(r, old)])
+                ranks = man_lists[r]
+                for w in ranks[ranks.index(old) + 1:ranks.index(new)]:
+                    history = woman_history.get(w, [])
+                    # 変化後の相手の順位は単調減少。r より好ましい相手になる最初の変化を二分探索
+                    lo, hi = 0, len(history)
+                    r_rank = woman_rank(w, r)
+                    while lo < hi:
+                        mid = (lo + hi) // 2
+                        if history[mid][1] < r_rank:
+                            hi = mid
+                        else:
+                            lo = mid + 1
+                    if lo < len(history) and history[lo][2] > r_rank:
+                        predecessors[index].add(history[lo][0])
+            predecessors[index].discard(index)
+
+        return {
+            'recipient_optimal': recipient_optimal,
+            'caregiver_optimal': caregiver_optimal,
+            'rotations': rotations,
+            'predecessors': [sorted(p) for p in predecessors]
+        }
+
+    @staticmethod
+    def _iter_closed_sets(predecessors: List[List[int]]) -> Iterator[Tuple[int, int]]:
+        """ローテーション半順序の閉集合を深さ優先で列挙する
+
+        ローテーションは除去可能な順（位相順）に並んでいるため、先頭から順に
+        「含めない」「（先行ローテーションが全て含まれていれば）含める」の
+        2通りを試すと、全ての閉集合が行き止まりなしにちょうど1回ずつ現れる。
+        再帰の代わりに明示的なスタックを使い、(イベント, 番号) を返す:
+        イベント 0 = 閉集合が1つ完成、1 = 番号のローテーションを追加、2 = 取り消し。
+        """
+        k = len(predecessors)
+        included = [False] * k
+        stack = [(0, 0)]
+        while stack:
+            index, phase = stack.pop()
+            if index == k:
+                yield 0, -1
+            elif phase == 0:
+                stack.append((index, 1))
+                stack.append((index + 1, 0))
+            elif phase == 1:
+                if all(included[p] for p in predecessors[index]):
+                    included[index] = True
+                    yield 1, index
+                    stack.append((index, 2))
+                    stack.append((index + 1, 0))
+            else:
+                included[index] = False
+                yield 2, index
+
+    @classmethod
+    def iter_stable_matchings(cls, lattice: Dict) -> Iterator[Dict[int, int]]:
+        """stable_matching_lattice の結果から全ての安定マッチングを列挙（1件あたり O(n)）"""
+        matching = dict(lattice['recipient_optimal'])
+        rotations = lattice['rotations']
+        for event, index in cls._iter_closed_sets(lattice['predecessors']):
+            if event == 0:
+                yield dict(matching)
+            elif event == 1:
+                for r, _, new in rotations[index]:
+                    matching[r] = new
+            else:
+                for r, old, _ in rotations[index]:
+                    matching[r] = old
+
+    @classmethod
+    def count_stable_matchings(cls, lattice: Dict, limit: Optional[int] = None) -> int:
+        """安定マッチングの数を数える（limit を指定するとその数で打ち切る）"""
+        count = 0
+        for event, _ in cls._iter_closed_sets(lattice['predecessors']):
+            if event == 0:
+                count += 1
+                if limit is not None and count >= limit:
+                    break
+        return count
+
     def print_matching_process(self, details: Dict):
         """
         マッチング過程を見やすく出力
@@ -160,6 +892,10 @@ class DeferredAcceptanceAlgorithm:
         print("=== Deferred Acceptance アルゴリズム実行過程 ===")
         print()
         
+        if details.get('trace') == "compact":
+            for line in self.iter_compact_trace(details):
+                print(line)
+        
         for step_info in details['history']:
             print(f"ステップ {step_info['step']}:")
             print(f"未マッチ被介護者: {step_info['unmatched_recipients']}")
@@ -175,6 +911,70 @@ class DeferredAcceptanceAlgorithm:
         print(f"未マッチ被介護者: {details['unmatched_recipients']}")
         print(f"ケアワーカー利用率: {details['caregiver_utilization']}")
     
+    @staticmethod
+    def iter_events(details: Dict) -> Iterator[Tuple[int, int, int, int]]:
+        """compact トレースのイベント (ステップ, 種別, 被介護者ID, ケアワーカーID) を順に返す"""
+        events = details.get('events', ())
+        for i in range(0, len(events), 4):
+            yield events[i], events[i + 1], events[i + 2], events[i + 3]
+
+    def iter_compact_trace(self, details: Dict) -> Iterator[str]:
+        """compact トレースを verbose と同じ形式の表示行へ遅延的に変換
+
+        イベントを先頭から再生して各ステップ開始時の未マッチ被介護者と
+        仮マッチ状況を復元する（並びは ID 昇順）。容量超過時は仮受入の直後に
+        同じケアワーカーの拒否イベントが続くため、verbose と同じく
+        「拒否」「残りを仮受入」の2行にまとめて表示する。
+        """
+        unmatched = set(details['final_matches']) | set(details['unmatched_recipients'])
+        held = {c: set() for c in details['caregiver_utilization']}
+        actions: List[str] = []
+        current_step = None
+        pending_accept: Optional[Tuple[int, int]] = None
+
+        def step_lines(step: int, start_unmatched: List[int],
+                       start_held: Dict[int, List[int]]) -> Iterator[str]:
+            yield f"ステップ {step}:"
+            yield f"未マッチ被介護者: {start_unmatched}"
+            for action in actions:
+                yield f"  - {action}"
+            yield f"仮マッチ状況: {start_held}"
+            yield ""
+
+        for step, kind, recipient, caregiver in self.iter_events(details):
+            if pending_accept is not None and not (kind == self.EVENT_REJECT and
+                                                   caregiver == pending_accept[1]):
+                actions.append(f"ケアワーカー{pending_accept[1]}が被介護者{pending_accept[0]}を仮受入")
+            if kind != self.EVENT_REJECT:
+                pending_accept = None
+            if step != current_step:
+                if current_step is not None:
+                    yield from step_lines(current_step, start_unmatched, start_held)
+                current_step = step
+                start_unmatched = sorted(unmatched)
+                start_held = {c: sorted(rs) for c, rs in held.items()}
+                actions = []
+            if kind == self.EVENT_PROPOSE:
+                actions.append(f"被介護者{recipient}がケアワーカー{caregiver}に提案")
+            elif kind == self.EVENT_EXHAUSTED:
+                unmatched.discard(recipient)
+                actions.append(f"被介護者{recipient}は提案先がないため未マッチ確定")
+            elif kind == self.EVENT_ACCEPT:
+                held[caregiver].add(recipient)
+                unmatched.discard(recipient)
+                pending_accept = (recipient, caregiver)
+            else:
+                held[caregiver].discard(recipient)
+                unmatched.add(recipient)
+                actions.append(f"ケアワーカー{caregiver}が被介護者{recipient}を拒否")
+                if pending_accept is not None and held[caregiver]:
+                    actions.append(f"ケアワーカー{caregiver}が{sorted(held[caregiver])}を仮受入")
+                pending_accept = None
+        if pending_accept is not None:
+            actions.append(f"ケアワーカー{pending_accept[1]}が被介護者{pending_accept[0]}を仮受入")
+        if current_step is not None:
+            yield from step_lines(current_step, start_unmatched, start_held)
+
     def is_stable_matching(self, 
                           matches: Dict[int, int],
                           recipient_preferences: Dict[int, List[int]],
@@ -183,6 +983,14 @@ class DeferredAcceptanceAlgorithm:
         """
         マッチングが安定かどうかを判定
         
+        逆順位表と各ケアワーカーの「仮受入者の最低順位」を1度だけ求め、
+        各被介護者の選好リストを現在のマッチまで走査するだけで判定する
+        （O(選好リスト長の総和)。旧実装はペアごとに全マッチの走査と list.index を
+        行っていた）。順位は create_match と同じく、選好リストにない被介護者は
+        最低優先度（同士は ID の小さい方を優先）とする。未マッチの被介護者も
+        選好リスト全体について調べる（旧実装はマッチ済みの被介護者だけを調べており、
+        未マッチの被介護者を含むブロッキングペアを見逃していた）。
+        
         Args:
             matches: マッチング結果
             recipient_preferences: 被介護者の選好
@@ -192,45 +1000,95 @@ class DeferredAcceptanceAlgorithm:
         Returns:
             Tuple[bool, List]: 安定性の判定結果とブロッキングペアのリスト
         """
+        rank = self.caregiver_rank_function(list(matches) + list(recipient_preferences),
+                                            caregiver_preferences)
+
+        # 各ケアワーカーの仮受入数と最低順位（最も好ましくない受入者の順位）
+        held_count: Dict[int, int] = {}
+        worst_rank: Dict[int, int] = {}
+        for recipient, caregiver in matches.items():
+            held_count[caregiver] = held_count.get(caregiver, 0) + 1
+            worst_rank[caregiver] = max(worst_rank.get(caregiver, -1), rank(caregiver, recipient))
+
         blocking_pairs = []
-        
-        # 各ケアワーカーの現在のマッチを取得
-        caregiver_matches = {}
-        for caregiver_id in caregiver_preferences.keys():
-            caregiver_matches[caregiver_id] = [r for r, c in matches.items() if c == caregiver_id]
-        
-        # 全ての被介護者-ケアワーカーペアをチェック
-        for recipient, current_match in matches.items():
+        unmatched = [r for r in recipient_preferences if r not in matches]
+        for recipient in list(matches) + unmatched:
+            current_match = matches.get(recipient)
             for caregiver in recipient_preferences[recipient]:
                 if caregiver == current_match:
                     break  # 現在のマッチ以上の選好はチェック済み
                 
-                # この被介護者がこのケアワーカーを現在のマッチより好む場合
-                current_matches = caregiver_matches[caregiver]
-                
-                # ケアワーカーに余裕がある場合
-                if len(current_matches) < caregiver_capacities[caregiver]:
-                    blocking_pairs.append((recipient, caregiver))
-                    continue
-                
-                # ケアワーカーがこの被介護者を現在のマッチの誰かより好む場合
-                worst_current = None
-                worst_pref_order = -1
-                
-                for current_recipient in current_matches:
-                    if current_recipient in caregiver_preferences[caregiver]:
-                        pref_order = caregiver_preferences[caregiver].index(current_recipient)
-                        if pref_order > worst_pref_order:
-                            worst_pref_order = pref_order
-                            worst_current = current_recipient
-                
-                if (recipient in caregiver_preferences[caregiver] and
-                    worst_current is not None and
-                    caregiver_preferences[caregiver].index(recipient) < worst_pref_order):
+                # ケアワーカーに余裕がある、または最低順位の受入者よりこの被介護者を好む
+                if (held_count.get(caregiver, 0) < caregiver_capacities[caregiver] or
+                        rank(caregiver, recipient) < worst_rank.get(caregiver, -1)):
                     blocking_pairs.append((recipient, caregiver))
         
         return len(blocking_pairs) == 0, blocking_pairs
 
+    def is_stable_matching_arrays(self,
+                                  matches: np.ndarray,
+                                  recipient_preferences: np.ndarray,
+                                  caregiver_ranks: np.ndarray,
+                                  capacities: np.ndarray) -> Tuple[Union[bool, np.ndarray], np.ndarray]:
+        """密な配列で表したマッチング（1件またはバッチ）の安定性を NumPy で一括判定
+
+        引数は create_match_arrays / create_match_batch と同じ形式。バッチ
+        （matches が2次元）の場合は create_match_batch と同様に1つの市場へ
+        まとめて判定する。
+
+        Returns:
+            Tuple[Union[bool, np.ndarray], np.ndarray]: 安定性（バッチではインスタンスごとの
+            bool 配列）と、ブロッキングペアのインデックス配列（1件なら (k, 2) の
+            [被介護者, ケアワーカー]、バッチなら (k, 3) の [インスタンス, 被介護者, ケアワーカー]）
+        """
+        match_array = np.asarray(matches)
+        preferences = np.asarray(recipient_preferences)
+        ranks = np.asarray(caregiver_ranks)
+        if match_array.ndim == 1:
+            pairs = self._blocking_pairs_arrays(match_array, preferences, ranks,
+                                                np.asarray(capacities), match_array.shape[0])
+            return pairs.shape[0] == 0, pairs
+
+        n_instances, n_recipients = match_array.shape
+        n_caregivers = ranks.shape[1]
+        capacity_array = np.broadcast_to(np.asarray(capacities), (n_instances, n_caregivers))
+        offsets = np.arange(n_instances) * n_caregivers
+        flat_matches = np.where(match_array >= 0, match_array + offsets[:, None], -1).reshape(-1)
+        flat_preferences = np.where(preferences >= 0, preferences + offsets[:, None, None], -1)
+        pairs = self._blocking_pairs_arrays(
+            flat_matches, flat_preferences.reshape(n_instances * n_recipients, -1),
+            ranks.reshape(n_instances * n_caregivers, n_recipients),
+            capacity_array.reshape(-1), n_recipients
+        )
+        instance = pairs[:, 0] // n_recipients
+        report = np.column_stack([instance, pairs[:, 0] % n_recipients,
+                                  pairs[:, 1] - offsets[instance]])
+        stable = np.bincount(instance, minlength=n_instances) == 0
+        return stable, report
+
+    @staticmethod
+    def _blocking_pairs_arrays(matches: np.ndarray, preferences: np.ndarray, ranks: np.ndarray,
+                               capacities: np.ndarray, n_local_recipients: int) -> np.ndarray:
+        """ブロッキングペア [被介護者, ケアワーカー] を全選好要素の一括演算で求める"""
+        n_caregivers = capacities.shape[0]
+        matches = matches.astype(np.int64)
+        matched = np.flatnonzero(matches >= 0)
+        held_count = np.bincount(matches[matched], minlength=n_caregivers)
+        worst_rank = np.full(n_caregivers, -1, dtype=np.int64)
+        np.maximum.at(worst_rank, matches[matched],
+                      ranks[matches[matched], matched % n_local_recipients].astype(np.int64))
+
+        # 現在のマッチより前にある選好要素だけを対象にする（未マッチならリスト全体）
+        valid = preferences >= 0
+        is_current = (preferences == matches[:, None]) & valid & (matches[:, None] >= 0)
+        before_current = np.cumsum(is_current, axis=1) == 0
+        recipients, positions = np.nonzero(valid & before_current)
+        caregivers = preferences[recipients, positions].astype(np.int64)
+
+        blocking = ((held_count[caregivers] < capacities[caregivers]) |
+                    (ranks[caregivers, recipients % n_local_recipients] < worst_rank[caregivers]))
+        return np.column_stack([recipients[blocking], caregivers[blocking]])
+
 
 def demo_da_algorithm():
     """DAアルゴリズムのデモ実行"""
@@ -296,6 +1154,19 @@ def demo_da_algorithm():
     if not is_stable:
         print(f"ブロッキングペア: {blocking_pairs}")
 
+    # 両側最適の比較と安定マッチングの列挙
+    lattice = da.stable_matching_lattice(
+        care_recipients, caregivers, recipient_preferences,
+        caregiver_preferences, caregiver_capacities
+    )
+    print()
+    print("=== 安定マッチングの束 ===")
+    print(f"被介護者側最適: {lattice['recipient_optimal']}")
+    print(f"ケアワーカー側最適: {lattice['caregiver_optimal']}")
+    print(f"ローテーション数: {len(lattice['rotations'])}")
+    for stable_matching in da.iter_stable_matchings(lattice):
+        print(f"  安定マッチング: {stable_matching}")
+
 
 if __name__ == "__main__":
     demo_da_algorithm()
\ No newline at end of file
@@ -18,12 +18,347 @@
 Author: 倉持誠 (Makoto Kuramochi)
 """
 
+import copy
+import heapq
 import itertools
+import math
+import random
+import time
+from collections import OrderedDict
+from fractions import Fraction
 from typing import List, Dict, Tuple, Optional, Sequence, Union
 import numpy as np
 from validation import InputValidator, ConstraintViolationError
 
 
+class PairwiseCostMatrix:
+    """1回の集約で共有するペアごとのコスト表
+
+    preference_cost[i, j]: candidates[i] を candidates[j] より前に置いたときに
+        主観的選好（全投票者の合計）と不一致になるペア数
+    fitness_cost[i, j]: 同じ配置でのフィット度距離への寄与
+        （ordinal: 理想ランキングとの不一致 0/1、gap: フィット度の差分）
+    cost = preference_weight * preference_cost + fitness_weight * fitness_cost
+
+    kemeny_distance / fitness_distance はどちらも順序付きペアごとのコストの和なので、
+    ランキング（候補者インデックス列）の距離はこの表の和として求まる。
+    表は NumPy で一括構築し、各ソルバーはランキング全体を O(n^2) の配列演算、
+    局所的な移動を O(1) の差分で評価する。
+    """
+
+    def __init__(self,
+                 preference_cost: np.ndarray,
+                 fitness_cost: np.ndarray,
+                 preference_weight: float = 1.0,
+                 fitness_weight: float = 1.0,
+                 cost: Optional[np.ndarray] = None):
+        self.preference_cost = np.asarray(preference_cost, dtype=np.int64)
+        self.fitness_cost = np.asarray(fitness_cost, dtype=np.int64)
+        self.preference_weight = preference_weight
+        self.fitness_weight = fitness_weight
+        if cost is None:
+            cost = (preference_weight * self.preference_cost +
+                    fitness_weight * self.fitness_cost).astype(np.float64)
+        self.cost = cost
+
+    @property
+    def n(self) -> int:
+        """候補者数"""
+        return self.cost.shape[0]
+
+    @staticmethod
+    def disagreement_counts(candidates: Sequence[int],
+                            rankings: Sequence[Sequence[int]]) -> np.ndarray:
+        """counts[i, j] = candidates[i] が candidates[j] より後ろにあるランキングの数
+
+        kemeny_distance と同様、ランキングに含まれない候補者のペアは数えない。
+        """
+        return PairwiseCostMatrix.disagreement_tensor(candidates, rankings).sum(axis=0)
+
+    @staticmethod
+    def disagreement_tensor(candidates: Sequence[int],
+                            rankings: Union[np.ndarray, Sequence[Sequence[int]]]) -> np.ndarray:
+        """ランキングごとの不一致表 tensor[v, i, j]（shape = (m, n, n)、0/1）"""
+        n = len(candidates)
+        if n == 0 or len(rankings) == 0:
+            return np.zeros((len(rankings), n, n), dtype=np.int64)
+
+        candidate_array = np.asarray(candidates)
+        sorter = np.argsort(candidate_array, kind='stable')
+        sorted_candidates = candidate_array[sorter]
+        ranking_array = np.asarray(rankings)
+        loc = np.minimum(np.searchsorted(sorted_candidates, ranking_array), n - 1)
+        valid = sorted_candidates[loc] == ranking_array
+
+        # positions[v, i] = 投票者 v における candidates[i] の位置（なければ -1）
+        positions = np.full((len(rankings), n), -1, dtype=np.int64)
+        rows, cols = np.nonzero(valid)
+        positions[rows, sorter[loc[rows, cols]]] = cols
+
+        present = positions >= 0
+        later = positions[:, :, None] > positions[:, None, :]
+        both = present[:, :, None] & present[:, None, :]
+        return (later & both).astype(np.int64)
+
+    @classmethod
+    def build(cls,
+              candidates: Sequence[int],
+              voters: Sequence[Sequence[int]],
+              fitness_scores: Sequence[int],
+              fitness_mode: str = "ordinal",
+              preference_weight: float = 1.0,
+              fitness_weight: float = 1.0) -> 'PairwiseCostMatrix':
+        """主観的選好プロファイルとフィット度からコスト表を構築
+
+        ExtendedKemenyRule.kemeny_distance / fitness_distance と同じ規則で
+        ペアごとのコストを求める（fitness_distance と同様、フィット度は
+        ランキング要素の値をインデックスとして参照する）。
+        """
+        preference_cost = cls.disagreement_counts(candidates, voters)
+        scores = np.asarray(fitness_scores, dtype=np.int64)
+
+        if fitness_mode == "ordinal":
+            # フィット度降順のインデックス列を理想ランキングとする（安定ソート）
+            ideal_ranking = np.argsort(-scores, kind='stable')
+            fitness_cost = cls.disagreement_counts(candidates, [ideal_ranking.tolist()])
+        else:
+            for c in candidates:
+                if not 0 <= c < len(scores):
+                    raise KeyError(c)
+            candidate_scores = scores[np.asarray(candidates, dtype=np.int64)]
+            # fitness_cost[i, j] = max(0, f[j] - f[i])
+            fitness_cost = np.maximum(
+                0, candidate_scores[None, :] - candidate_scores[:, None]
+            )
+
+        return cls(preference_cost, fitness_cost, preference_weight, fitness_weight)
+
+    @classmethod
+    def build_batch(cls,
+                    candidates: Sequence[int],
+                    preferences: np.ndarray,
+                    fitness_scores: np.ndarray,
+                    fitness_mode: str = "ordinal",
+                    preference_weight: float = 1.0,
+                    fitness_weight: float = 1.0) -> List['PairwiseCostMatrix']:
+        """候補者集合を共有する複数エージェントのコスト表を一括構築
+
+        preferences[a] / fitness_scores[a] はエージェント a の主観的選好（1件）と
+        フィット度。(エージェント数, n, n) のテンソルを一度に計算し、
+        エージェントごとのビューとして返す。
+        """
+        preference_cost = cls.disagreement_tensor(candidates, preferences)
+        scores = np.asarray(fitness_scores, dtype=np.int64).reshape(len(preferences), -1)
+
+        if fitness_mode == "ordinal":
+            ideal_rankings = np.argsort(-scores, axis=1, kind='stable')
+            fitness_cost = cls.disagreement_tensor(candidates, ideal_rankings)
+        else:
+            for c in candidates:
+                if not 0 <= c < scores.shape[1]:
+                    raise KeyError(c)
+            candidate_scores = scores[:, np.asarray(candidates, dtype=np.int64)]
+            fitness_cost = np.maximum(
+                0, candidate_scores[:, None, :] - candidate_scores[:, :, None]
+            )
+
+        cost = (preference_weight * preference_cost +
+                fitness_weight * fitness_cost).astype(np.float64)
+        return [cls(preference_cost[a], fitness_cost[a], preference_weight, fitness_weight,
+                    cost=cost[a])
+                for a in range(len(preferences))]
+
+    def updated(self,
+                candidates: Sequence[int],
+                old_voters: Sequence[Sequence[int]],
+                new_voters: Sequence[Sequence[int]],
+                old_fitness_scores: Sequence[int],
+                new_fitness_scores: Sequence[int],
+                fitness_mode: str = "ordinal") -> 'PairwiseCostMatrix':
+        """入力の差分だけを反映した新しいコスト表を返す（自身は変更しない）
+
+        主観的選好は変化した投票者の寄与だけを差し替える。フィット度は
+        値が変わったインデックスに対応する候補者の行・列だけを再計算する
+        （順位化しても他の候補者どうしの大小関係は変わらないため）。
+        """
+        preference_cost = self.preference_cost
+        if len(old_voters) != len(new_voters):
+            preference_cost = self.disagreement_counts(candidates, new_voters)
+        else:
+            changed = [v for v in range(len(new_voters))
+                       if list(old_voters[v]) != list(new_voters[v])]
+            if changed:
+                preference_cost = (
+                    preference_cost
+                    - self.disagreement_counts(candidates, [old_voters[v] for v in changed])
+                    + self.disagreement_counts(candidates, [new_voters[v] for v in changed])
+                )
+
+        fitness_cost = self.fitness_cost
+        changed_rows: List[int] = []
+        if len(old_fitness_scores) != len(new_fitness_scores):
+            fitness_cost = PairwiseCostMatrix.build(
+                candidates, [], new_fitness_scores, fitness_mode
+            ).fitness_cost
+        else:
+            changed_ids = {p for p in range(len(new_fitness_scores))
+                           if old_fitness_scores[p] != new_fitness_scores[p]}
+            changed_rows = [i for i, c in enumerate(candidates) if c in changed_ids]
+        if changed_rows:
+            fitness_cost = fitness_cost.copy()
+            scores = np.asarray(new_fitness_scores, dtype=np.int64)
+            candidate_ids = np.asarray(candidates, dtype=np.int64)
+            rows = np.asarray(changed_rows, dtype=np.intp)
+            if fitness_mode == "ordinal":
+                # rank[p] = 理想ランキングにおけるインデックス p の位置（範囲外の候補者は -1）
+                rank = np.empty(len(scores), dtype=np.int64)
+                rank[np.argsort(-scores, kind='stable')] = np.arange(len(scores))
+                valid = (candidate_ids >= 0) & (candidate_ids < len(scores))
+                candidate_rank = np.where(valid, rank[np.where(valid, candidate_ids, 0)], -1)
+                row_rank = candidate_rank[rows][:, None]
+                both = (row_rank >= 0) & (candidate_rank[None, :] >= 0)
+                fitness_cost[rows, :] = both & (row_rank > candidate_rank[None, :])
+                fitness_cost[:, rows] = (both & (candidate_rank[None, :] > row_rank)).T
+            else:
+                for c in candidates:
+                    if not 0 <= c < len(scores):
+                        raise KeyError(c)
+                candidate_scores = scores[candidate_ids]
+                row_scores = candidate_scores[rows][:, None]
+                # fitness_cost[i, j] = max(0, f[j] - f[i]) を変化した行・列だけ再計算
+                fitness_cost[rows, :] = np.maximum(0, candidate_scores[None, :] - row_scores)
+                fitness_cost[:, rows] = np.maximum(
+                    0, row_scores.T - candidate_scores[:, None]
+                )
+
+        if preference_cost is self.preference_cost and changed_rows:
+            # フィット度だけが変わった場合は影響する行・列の総合コストだけを更新
+            cost = self.cost.copy()
+            cost[rows, :] = (self.preference_weight * preference_cost[rows, :] +
+                             self.fitness_weight * fitness_cost[rows, :])
+            cost[:, rows] = (self.preference_weight * preference_cost[:, rows] +
+                             self.fitness_weight * fitness_cost[:, rows])
+            return PairwiseCostMatrix(preference_cost, fitness_cost,
+                                      self.preference_weight, self.fitness_weight, cost=cost)
+        if preference_cost is self.preference_cost and fitness_cost is self.fitness_cost:
+            return self
+        return PairwiseCostMatrix(preference_cost, fitness_cost,
+                                  self.preference_weight, self.fitness_weight)
+
+    def distances_many(self, orders: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """複数ランキング（shape = (k, n) のインデックス配列）の距離を一括計算
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: 主観的選好距離とフィット度距離（長さ k）
+        """
+        orders = np.asarray(orders, dtype=np.intp)
+        if self.n < 2:
+            zeros = np.zeros(len(orders), dtype=np.int64)
+            return zeros, zeros.copy()
+        upper_i, upper_j = np.triu_indices(self.n, 1)
+        first = orders[:, upper_i]
+        second = orders[:, upper_j]
+        return (self.preference_cost[first, second].sum(axis=1),
+                self.fitness_cost[first, second].sum(axis=1))
+
+    def preference_distance(self, order: Sequence[int]) -> int:
+        """主観的選好との不一致数（プロファイルの総和）"""
+        return int(self.distances_many(np.asarray([order]).reshape(1, self.n))[0][0])
+
+    def fitness_distance(self, order: Sequence[int]) -> int:
+        """フィット度距離"""
+        return int(self.distances_many(np.asarray([order]).reshape(1, self.n))[1][0])
+
+    def submatrix(self, indices: Sequence[int]) -> 'PairwiseCostMatrix':
+        """指定インデックスの候補者だけからなるコスト表"""
+        index = np.asarray(indices, dtype=np.intp)
+        grid = np.ix_(index, index)
+        return PairwiseCostMatrix(self.preference_cost[grid], self.fitness_cost[grid],
+                                  self.preference_weight, self.fitness_weight)
+
+    def condorcet_components(self) -> List[List[int]]:
+        """重み付き多数決トーナメントの強連結成分を順位順に返す
+
+        cost[a, b] <= cost[b, a]（a を先に置いても損をしない）なら辺 a→b を張る。
+        同点のペアは両方向の辺になり同じ成分に入るため、異なる成分間では
+        全てのペアが一方向に厳密に優越する。このとき任意の最適ランキングは
+        成分をこの順に並べたものになる（拡張 Condorcet 基準）。
+
+        Returns:
+            List[List[int]]: 成分（昇順のインデックス列）のリスト（上位の成分から）
+        """
+        n = self.n
+        tolerance = self.tie_tolerance()
+        precedes = self.cost <= self.cost.T + tolerance
+        np.fill_diagonal(precedes, False)
+        successors = [np.flatnonzero(row).tolist() for row in precedes]
+
+        # Tarjan 法（反復版）。成分は逆トポロジカル順（下位から）に確定する
+        index_of = [-1] * n
+        lowlink = [0] * n
+        on_stack = [False] * n
+        stack: List[int] = []
+        components: List[List[int]] = []
+        counter = 0
+        for root in range(n):
+            if index_of[root] != -1:
+                continue
+            work = [(root, 0)]
+            while work:
+                v, child = work.pop()
+                if child == 0:
+                    index_of[v] = lowlink[v] = counter
+                    counter += 1
+                    stack.append(v)
+                    on_stack[v] = True
+                recurse = False
+                for i in range(child, len(successors[v])):
+                    w = successors[v][i]
+                    if index_of[w] == -1:
+                        work.append((v, i + 1))
+                        work.append((w, 0))
+                        recurse = True
+                        break
+                    if on_stack[w]:
+                        lowlink[v] = min(lowlink[v], index_of[w])
+                if recurse:
+                    continue
+                if lowlink[v] == index_of[v]:
+                    component = []
+                    while True:
+                        w = stack.pop()
+                        on_stack[w] = False
+                        component.append(w)
+                        if w == v:
+                            break
+                    components.append(sorted(component))
+                if work:
+                    parent = work[-1][0]
+                    lowlink[parent] = min(lowlink[parent], lowlink[v])
+        components.reverse()
+        return components
+
+    def tie_tolerance(self) -> float:
+        """スコアの同点判定に用いる許容誤差
+
+        重みが 0.1 のように2進で表せない値の場合、ペアコストを足す順序により
+        数学的に同点のランキングでも末尾ビットが異なるため、厳密解法では
+        この幅の差を同点として扱う。
+        """
+        return 1e-9 * max(1.0, float(np.abs(self.cost).sum()))
+
+    def lower_bound(self) -> float:
+        """任意のランキングの総合スコアの下界 Σ_{i<j} min(cost[i,j], cost[j,i])"""
+        return float(np.triu(np.minimum(self.cost, self.cost.T), 1).sum())
+
+    def order_cost(self, order: Sequence[int]) -> float:
+        """重み付き総合スコア（ペアコストの和）"""
+        if self.n < 2:
+            return 0.0
+        index = np.asarray(order, dtype=np.intp)
+        return float(np.triu(self.cost[np.ix_(index, index)], 1).sum())
+
+
 class ExtendedKemenyRule:
     """拡張版Kemenyルールの実装クラス
 
@@ -34,10 +369,26 @@ class ExtendedKemenyRule:
     自然な形で主観選好 vs 客観的差分のトレードオフを観察できるようにする。
     """
     
+    # 部分集合DPで扱う候補者数の上限（2^n 要素の配列を確保するため）
+    DP_MAX_CANDIDATES = 25
+
+    # 全探索で一度に距離計算する (順列数 × ペア数) の目安
+    BRUTE_FORCE_CHUNK_ELEMENTS = 1 << 18
+
+    SOLVERS = ("brute_force", "dp", "branch_and_bound", "local_search")
+    EXACT_SOLVERS = ("brute_force", "dp", "branch_and_bound")
+
     def __init__(self,
                  preference_weight: float = 1.0,
                  fitness_weight: float = 1.0,
-                 fitness_mode: str = "ordinal"):
+                 fitness_mode: str = "ordinal",
+                 solver: str = "brute_force",
+                 solver_options: Optional[Dict] = None,
+                 details: str = "all",
+                 top_k: int = 10,
+                 decompose: bool = True,
+                 cache_size: int = 0,
+                 shortlist: Optional[int] = None):
         """
         拡張版Kemenyルールの初期化
         
@@ -47,12 +398,59 @@ class ExtendedKemenyRule:
             fitness_mode: フィット度距離の算出方法
                 - "ordinal": これまで通りフィット度を順位化しKemeny距離
                 - "gap": フィット度の差分大きさをペア逆転毎に加算
+            solver: 最適ランキングの探索方法
+                - "brute_force": 全順列を列挙（既定、全候補の計算詳細を記録）
+                - "dp": 部分集合（ビットマスク）DPによる厳密解 O(2^n・n^2)
+                - "branch_and_bound": 分枝限定法による厳密解（選好とフィット度が
+                  概ね一致する入力で高速）
+                - "local_search": 挿入・隣接交換の局所探索（近似解、30〜100候補向け）
+            solver_options: ソルバー固有の設定（local_search のみ使用）
+                - "restarts": 焼きなましによる再出発回数（既定 0）
+                - "anneal_steps": 再出発1回あたりの焼きなまし手数（既定 20n）
+                - "max_iterations": 局所探索の最大反復回数（既定 1000）
+                - "random_seed": 乱数シード（既定 0、結果の再現性のため）
+            details: brute_force で記録する計算詳細
+                - "all": 全順列の計算詳細を記録（既定）
+                - "top_k": スコア上位 top_k 件のみを有界ヒープで保持（メモリ O(k)）
+            top_k: details="top_k" のときに保持する件数
+            decompose: 厳密解法（dp / branch_and_bound）の前に多数決トーナメントの
+                強連結成分へ分解し、成分ごとに解く（結果は分解しない場合と同一）
+            cache_size: 集約結果のLRUキャッシュの最大件数（0 で無効、既定）。
+                候補者を主観的選好の順に振り直した標準形をキーにする。結果は
+                キャッシュ無効時と常に同一で、ラベルの付け替えで一致する入力の
+                解を使い回すのは、厳密解法の最適解が一意と確認できた場合に限る。
+            shortlist: 上位候補の件数 K（None で無効、既定）。候補者数が K を超える場合、
+                ペアコスト表の行和（Borda 型の得点）上位 K 人だけを設定されたソルバーで
+                解き、残りは同じ得点順で後ろに連結する。上位 K 人が残り全員に
+                ペアごとに負けない場合は、その上位 K 件が最適ランキングの上位 K 件と
+                一致することが保証される（計算詳細の solver_stats['shortlist_optimal']）。
         """
         self.preference_weight = preference_weight
         self.fitness_weight = fitness_weight
         self.fitness_mode = fitness_mode  # 新規追加
         if self.fitness_mode not in ("ordinal", "gap"):
             raise ValueError("fitness_mode は 'ordinal' か 'gap' を指定してください")
+        self.solver = solver
+        if self.solver not in self.SOLVERS:
+            raise ValueError(f"solver は {self.SOLVERS} のいずれかを指定してください")
+        self.solver_options = dict(solver_options or {})
+        self.details = details
+        if self.details not in ("all", "top_k"):
+            raise ValueError("details は 'all' か 'top_k' を指定してください")
+        if top_k < 1:
+            raise ValueError("top_k は1以上を指定してください")
+        self.top_k = top_k
+        self.decompose = decompose
+        if cache_size < 0:
+            raise ValueError("cache_size は0以上を指定してください")
+        self.cache_size = cache_size
+        if shortlist is not None and shortlist < 1:
+            raise ValueError("shortlist は1以上を指定してください")
+        self.shortlist = shortlist
+        # キー: 標準形（ラベル付け替えで再利用可能な解）または (標準形, 元のラベルの並び)
+        # 値: (標準形の解, 標準形の計算詳細, ソルバー統計)
+        self._cache: 'OrderedDict[tuple, Tuple[List[int], Optional[List[Dict]], Dict]]' = OrderedDict()
+        self._cache_stats = {'hits': 0, 'misses': 0, 'evictions': 0}
     
     def kemeny_distance(self, ranking1: Sequence[int], ranking2: Sequence[int]) -> int:
         """Kemeny距離（= Kendall tau 距離: ペアの不一致数）を計算
@@ -61,32 +459,86 @@ class ExtendedKemenyRule:
         集計ランキング σ を求める際に Σ_v dist_Kendall(σ, π_v) を最小化する。
         本実装の単一ランキング版はその特殊形 (m=1) であり、距離は Kendall tau 不一致ペア数。
 
-        旧実装はペアごとに ranking2.index(...) を呼び O(n^3) になっていたため、
-        位置マップを事前計算し O(n^2) に最適化。
+        旧実装はペアごとに ranking2.index(...) を呼び O(n^3)、その後の版でも
+        二重ループの O(n^2) だったため、ranking1 を ranking2 での位置列に変換し
+        マージソートで転倒数を数える O(n log n) に最適化。
         """
         if len(ranking1) != len(ranking2):
             raise ValueError("ランキングの長さが一致しません")
 
-        # 要素→位置 の辞書を構築（O(n)）
+        # 要素→位置 の辞書を構築（O(n)）。ranking2 にない要素は比較対象外
         pos_map = {elem: i for i, elem in enumerate(ranking2)}
+        positions = [pos_map[elem] for elem in ranking1 if elem in pos_map]
+        return self._count_inversions(positions)
 
-        distance = 0
-        n = len(ranking1)
-        for i in range(n):
-            ai = ranking1[i]
-            pi = pos_map.get(ai)
-            if pi is None:
-                # 想定外（完全な順列でない）
-                continue
-            for j in range(i + 1, n):
-                aj = ranking1[j]
-                pj = pos_map.get(aj)
-                if pj is None:
-                    continue
-                # ranking1 では ai が aj より前。ranking2 で逆なら不一致
-                if pi > pj:
-                    distance += 1
-        return distance
+    @staticmethod
+    def _count_inversions(sequence: List[int]) -> int:
+        """転倒数（i < j かつ sequence[i] > sequence[j] となるペア数）をマージソートで計算"""
+        n = len(sequence)
+        if n < 2:
+            return 0
+        inversions = 0
+        current = list(sequence)
+        width = 1
+        # ボトムアップのマージソート: 右側の要素を先に取るたびに左側の残り数を加算
+        while width < n:
+            merged = []
+            for start in range(0, n, 2 * width):
+                left = current[start:start + width]
+                right = current[start + width:start + 2 * width]
+                i = j = 0
+                n_left = len(left)
+                while i < n_left and j < len(right):
+                    if left[i] <= right[j]:
+                        merged.append(left[i])
+                        i += 1
+                    else:
+                        merged.append(right[j])
+                        inversions += n_left - i
+                        j += 1
+                merged.extend(left[i:])
+                merged.extend(right[j:])
+            current = merged
+            width *= 2
+        return inversions
+
+    def kemeny_distance_many(self, rankings: Union[np.ndarray, Sequence[Sequence[int]]],
+                             reference: Sequence[int]) -> np.ndarray:
+        """複数ランキングと基準ランキングの Kemeny 距離を一括計算
+
+        Args:
+            rankings: shape = (k, n) のランキング配列（各行が1つのランキング）
+            reference: 基準ランキング（長さ n）
+
+        Returns:
+            np.ndarray: 各ランキングの距離（長さ k、int64）。kemeny_distance と同じく
+            reference に含まれない要素のペアは数えない。
+        """
+        ranking_array = np.asarray(rankings)
+        if ranking_array.ndim != 2:
+            raise ValueError("rankings は2次元配列で指定してください")
+        k, n = ranking_array.shape
+        if n != len(reference):
+            raise ValueError("ランキングの長さが一致しません")
+        if n < 2 or k == 0:
+            return np.zeros(k, dtype=np.int64)
+
+        # 各要素を reference での位置に変換（存在しない要素は -1）
+        reference_array = np.asarray(reference)
+        sorter = np.argsort(reference_array, kind='stable')
+        sorted_reference = reference_array[sorter]
+        loc = np.minimum(np.searchsorted(sorted_reference, ranking_array), n - 1)
+        valid = sorted_reference[loc] == ranking_array
+        positions = np.where(valid, sorter[loc], -1)
+
+        # オフセット d ごとに (i, i+d) ペアの逆転を全行まとめて数える
+        distances = np.zeros(k, dtype=np.int64)
+        for d in range(1, n):
+            earlier = positions[:, :-d]
+            later = positions[:, d:]
+            inverted = (earlier > later) & (later >= 0)
+            distances += inverted.sum(axis=1)
+        return distances
 
     def kemeny_distance_profile(self, ranking: Sequence[int], profile: Sequence[Sequence[int]]) -> int:
         """複数の主観的選好プロファイルに対する合計Kemeny距離を計算
@@ -119,19 +571,72 @@ class ExtendedKemenyRule:
             return float(self.kemeny_distance(ranking, ideal_ranking))
 
         # gap モード
+        # 旧実装は全ペアの二重ループ O(n^2)。ランキングを後ろから走査し、
+        # 既に見た（= 後ろにある）候補のうちフィット度が高いものの件数と合計を
+        # フィット度の順位上の Fenwick 木（BIT）で数えて O(n log n) に最適化。
+        # a の後ろにある f[b] > f[a] の b について Σ (f[b] - f[a]) = 合計 - f[a]・件数
         score_lookup = {i: fitness_scores[i] for i in range(len(fitness_scores))}
+        values = [score_lookup[elem] for elem in ranking]
+        rank_of = {value: r for r, value in enumerate(sorted(set(values)), start=1)}
+        size = len(rank_of)
+        tree_count = [0] * (size + 1)
+        tree_sum = [0] * (size + 1)
+        seen_count = 0
+        seen_sum = 0
         penalty = 0.0
-        n = len(ranking)
-        # ランキング内の順序 i<j で ranking[i] を上位とする
-        for i in range(n):
-            a = ranking[i]
-            for j in range(i + 1, n):
-                b = ranking[j]
-                # もし a のフィット度 < b のフィット度 なのに a を上に置いたら差分をペナルティ
-                diff = score_lookup[b] - score_lookup[a]
-                if diff > 0:  # 逆転（本来 b の方が高い）
-                    penalty += diff
+        for value in reversed(values):
+            # 順位が value 以下の既出候補の件数と合計（接頭辞和）
+            r = rank_of[value]
+            count = 0
+            total = 0
+            while r > 0:
+                count += tree_count[r]
+                total += tree_sum[r]
+                r -= r & -r
+            penalty += (seen_sum - total) - value * (seen_count - count)
+
+            r = rank_of[value]
+            while r <= size:
+                tree_count[r] += 1
+                tree_sum[r] += value
+                r += r & -r
+            seen_count += 1
+            seen_sum += value
         return penalty
+
+    def fitness_distance_many(self, rankings: Union[np.ndarray, Sequence[Sequence[int]]],
+                              fitness_scores: Sequence[int]) -> np.ndarray:
+        """複数ランキングのフィット度距離を一括計算（fitness_distance のベクトル版）
+
+        Args:
+            rankings: shape = (k, n) のランキング配列（各行が1つのランキング）
+            fitness_scores: フィット度スコア（長さ n、ランキング要素の値で参照）
+
+        Returns:
+            np.ndarray: 各ランキングのフィット度距離（長さ k、float64）
+        """
+        # 空のランキング（n=0）でも浮動小数と推定されないよう整数型で受け取る
+        ranking_array = np.asarray(rankings, dtype=np.intp)
+        if ranking_array.ndim != 2:
+            raise ValueError("rankings は2次元配列で指定してください")
+        k, n = ranking_array.shape
+        if n != len(fitness_scores):
+            raise ValueError("ランキングとフィット度スコアの長さが一致しません")
+
+        if self.fitness_mode == "ordinal":
+            ideal_ranking = sorted(range(n), key=lambda idx: fitness_scores[idx], reverse=True)
+            return self.kemeny_distance_many(ranking_array, ideal_ranking).astype(np.float64)
+
+        for elem in np.unique(ranking_array).tolist():
+            if not 0 <= elem < n:
+                raise KeyError(elem)
+        values = np.asarray(fitness_scores)[ranking_array]
+
+        # オフセット d ごとに (i, i+d) ペアの正の差分を全行まとめて加算
+        penalties = np.zeros(k, dtype=np.float64)
+        for d in range(1, n):
+            penalties += np.maximum(0, values[:, d:] - values[:, :-d]).sum(axis=1)
+        return penalties
     
     def generate_all_permutations(self, items: List[int]) -> List[List[int]]:
         """
@@ -148,7 +653,9 @@ class ExtendedKemenyRule:
     def aggregate_preferences(self, 
                             subjective_preference: Union[List[int], List[List[int]]],
                             fitness_scores: Union[List[int], List[float]],
-                            candidates: Optional[List[int]] = None) -> Tuple[List[int], Dict]:
+                            candidates: Optional[List[int]] = None,
+                            time_budget: Optional[float] = None,
+                            deadline: Optional[float] = None) -> Tuple[List[int], Dict]:
         """
         主観的選好と客観的フィット度を統合して最適なランキングを生成
         
@@ -156,10 +663,17 @@ class ExtendedKemenyRule:
         - フィット度は整数のみ（実数は拒否）
         - フィット度は単射性（重複なし）
         
+        time_budget / deadline を指定すると、ソルバーは期限までに打ち切り
+        その時点の最良解を返す。期限は呼び出し時点から（入力検証とコスト表構築を含めて）
+        数え、超過は O(n^2) の処理1回分程度に収まる。計算詳細の lower_bound（証明済みの下界）と
+        optimality_gap（best_score - lower_bound）で解の品質を確認できる。
+        
         Args:
             subjective_preference: 主観的選好ランキング
             fitness_scores: 客観的フィット度スコア（整数のみ）
             candidates: 候補者のリスト（省略時は0からN-1）
+            time_budget: 計算時間の上限（秒、省略時は無制限）
+            deadline: 計算の期限（time.time() の時刻、省略時は無制限）
             
         Returns:
             Tuple[List[int], Dict]: 最適ランキングと計算詳細
@@ -167,6 +681,48 @@ class ExtendedKemenyRule:
         Raises:
             ConstraintViolationError: 制約違反時
         """
+        # 期限は入力検証・コスト表構築を含めた呼び出し全体に対して数える
+        solver_deadline = self._solver_deadline(time_budget, deadline)
+        candidates, voters, preference_profile, validated_fitness_scores = self._prepare_inputs(
+            subjective_preference, fitness_scores, candidates
+        )
+        # ペアコスト表は集約1回につき1度だけ構築し、全ソルバーで共有する
+        matrix = PairwiseCostMatrix.build(
+            candidates, voters, validated_fitness_scores, self.fitness_mode,
+            self.preference_weight, self.fitness_weight
+        )
+        seeds = self._seed_orders(candidates, voters, validated_fitness_scores)
+
+        return self._aggregate_with_matrix(candidates, matrix, seeds, preference_profile,
+                                           deadline=solver_deadline)
+
+    @staticmethod
+    def _solver_deadline(time_budget: Optional[float], deadline: Optional[float],
+                         start: Optional[float] = None) -> Optional[float]:
+        """time_budget（秒）と deadline（time.time() の時刻）を time.monotonic() 基準の期限に変換
+
+        time_budget は start（time.monotonic() の時刻、省略時は現在）から数える。
+        """
+        if time_budget is not None and time_budget < 0:
+            raise ValueError("time_budget は0以上を指定してください")
+        now = time.monotonic()
+        limits = []
+        if time_budget is not None:
+            limits.append((now if start is None else start) + time_budget)
+        if deadline is not None:
+            limits.append(now + (deadline - time.time()))
+        return min(limits) if limits else None
+
+    @staticmethod
+    def _expired(deadline: Optional[float]) -> bool:
+        """期限（time.monotonic() 基準）を過ぎたか"""
+        return deadline is not None and time.monotonic() >= deadline
+
+    def _prepare_inputs(self, subjective_preference: Union[List[int], List[List[int]]],
+                        fitness_scores: Union[List[int], List[float]],
+                        candidates: Optional[List[int]]
+                        ) -> Tuple[List[int], List[List[int]], Optional[List[List[int]]], List[int]]:
+        """入力を検証し、(候補者, 投票者ランキング群, プロファイル or None, 整数フィット度) に整える"""
         # 制約検証：フィット度の整数性
         InputValidator.validate_fitness_scores_are_integers(fitness_scores)
         
@@ -196,58 +752,250 @@ class ExtendedKemenyRule:
         if n_candidates != len(validated_fitness_scores):
             raise ValueError("主観的選好(単一またはプロファイル)とフィット度スコアの長さが一致しません")
         
-        # 全ての可能な順列を生成
-        all_permutations = self.generate_all_permutations(candidates)
-        
-        best_ranking: List[int] = []
-        best_score = float('inf')
-        calculation_details = []
-        
-        # 各順列に対してスコアを計算
-        for permutation in all_permutations:
-            perm_list = permutation.copy()
-            
-            # 主観的選好との不一致数（プロファイルなら総和）
-            if is_profile:
-                preference_distance = self.kemeny_distance_profile(perm_list, pref_profile)
+        if len(candidates) != n_candidates:
+            raise ValueError("ランキングの長さが一致しません")
+
+        voters = pref_profile if is_profile else [subjective_preference]
+        return list(candidates), voters, (pref_profile if is_profile else None), validated_fitness_scores
+
+    def aggregate_batch(self,
+                        preferences: Union[np.ndarray, Sequence[Sequence[int]]],
+                        fitness_scores: Union[np.ndarray, Sequence[Sequence[int]]],
+                        candidates: Optional[Sequence[int]] = None,
+                        time_budget: Optional[float] = None,
+                        deadline: Optional[float] = None
+                        ) -> Tuple[List[List[int]], List[Dict]]:
+        """候補者集合を共有する複数エージェントの選好を一括で統合
+
+        各エージェントについて aggregate_preferences(preferences[a], fitness_scores[a],
+        candidates) と同じ結果を返すが、入力検証とペアコスト表の構築を
+        全エージェント分まとめて NumPy で1回だけ行う。
+
+        Args:
+            preferences: shape = (エージェント数, n) の主観的選好ランキング（候補者ID）
+            fitness_scores: shape = (エージェント数, n) のフィット度（整数のみ）
+            candidates: 全エージェント共通の候補者リスト（省略時は0からN-1）
+            time_budget: エージェント1人あたりの計算時間の上限（秒）。
+                1人の計算が長引いても他のエージェントの時間は削られない
+            deadline: 全体の期限（time.time() の時刻）
+
+        Returns:
+            Tuple[List[List[int]], List[Dict]]: 入力順の最適ランキングと計算詳細
+
+        Raises:
+            ConstraintViolationError: 制約違反時
+        """
+        entry = time.monotonic()
+        solver_deadline = self._solver_deadline(None, deadline)
+        preference_array = np.asarray(preferences)
+        fitness_array = InputValidator.validate_fitness_matrix(fitness_scores, "入力フィット度")
+        if preference_array.ndim != 2 or fitness_array.ndim != 2:
+            raise ValueError("preferences と fitness_scores は2次元配列で指定してください")
+        if preference_array.shape != fitness_array.shape:
+            raise ValueError("主観的選好(単一またはプロファイル)とフィット度スコアの長さが一致しません")
+        n_agents, n_candidates = preference_array.shape
+        if candidates is None:
+            candidates = list(range(n_candidates))
+        candidates = list(candidates)
+        if len(candidates) != n_candidates:
+            raise ValueError("ランキングの長さが一致しません")
+
+        matrices = PairwiseCostMatrix.build_batch(
+            candidates, preference_array, fitness_array, self.fitness_mode,
+            self.preference_weight, self.fitness_weight
+        )
+
+        # 一括で行った検証・コスト表構築の時間は各エージェントの time_budget に等分して含める
+        shared_elapsed = (time.monotonic() - entry) / max(1, n_agents)
+
+        rankings: List[List[int]] = []
+        details_list: List[Dict] = []
+        for preference, fitness, matrix in zip(preference_array.tolist(),
+                                               fitness_array.tolist(), matrices):
+            agent_deadline = solver_deadline
+            if time_budget is not None:
+                budget_deadline = self._solver_deadline(
+                    time_budget, None, start=time.monotonic() - shared_elapsed
+                )
+                agent_deadline = (budget_deadline if solver_deadline is None
+                                  else min(budget_deadline, solver_deadline))
+            seeds = self._seed_orders(candidates, [preference], fitness)
+            ranking, details = self._aggregate_with_matrix(
+                candidates, matrix, seeds, None, deadline=agent_deadline
+            )
+            rankings.append(ranking)
+            details_list.append(details)
+        return rankings, details_list
+
+    def aggregate_incremental(self,
+                              subjective_preference: Union[List[int], List[List[int]]],
+                              fitness_scores: Union[List[int], List[float]],
+                              candidates: Optional[List[int]] = None,
+                              previous_state: Optional[Dict] = None
+                              ) -> Tuple[List[int], Dict, Dict]:
+        """前回の集約結果を再利用して、入力の一部が変わったエージェントを再集約
+
+        previous_state（前回この関数が返した状態）がある場合、ペアコスト表は
+        変化したフィット度・主観的選好に関わる部分だけを更新し、前回の最適解を
+        初期解として再最適化する（local_search は前回解からの局所探索、
+        branch_and_bound は前回解を暫定解に加える。dp / brute_force は
+        コスト表の再構築だけを省く）。previous_state が None なら通常の集約を行う。
+
+        Args:
+            subjective_preference: 主観的選好ランキング（単一またはプロファイル）
+            fitness_scores: 客観的フィット度スコア（整数のみ）
+            candidates: 候補者のリスト（省略時は0からN-1、前回と同じであること）
+            previous_state: 前回の呼び出しが返した状態辞書
+
+        Returns:
+            Tuple[List[int], Dict, Dict]: 最適ランキング、計算詳細、次回用の状態辞書
+        """
+        candidates, voters, preference_profile, validated_fitness_scores = self._prepare_inputs(
+            subjective_preference, fitness_scores, candidates
+        )
+        seeds = self._seed_orders(candidates, voters, validated_fitness_scores)
+
+        warm_start = None
+        if previous_state is not None and previous_state['candidates'] == candidates:
+            matrix = previous_state['matrix'].updated(
+                candidates, previous_state['voters'], voters,
+                previous_state['fitness_scores'], validated_fitness_scores, self.fitness_mode
+            )
+            index_of = {c: i for i, c in enumerate(candidates)}
+            warm_start = [index_of[c] for c in previous_state['ranking']]
+        else:
+            matrix = PairwiseCostMatrix.build(
+                candidates, voters, validated_fitness_scores, self.fitness_mode,
+                self.preference_weight, self.fitness_weight
+            )
+
+        best_ranking, details = self._aggregate_with_matrix(
+            candidates, matrix, seeds, preference_profile, warm_start
+        )
+        details['warm_started'] = warm_start is not None
+        state = {
+            'candidates': candidates,
+            'voters': [list(v) for v in voters],
+            'fitness_scores': validated_fitness_scores,
+            'matrix': matrix,
+            'ranking': best_ranking
+        }
+        return best_ranking, details, state
+
+    def weight_breakpoints(self,
+                           subjective_preference: Union[List[int], List[List[int]]],
+                           fitness_scores: Union[List[int], List[float]],
+                           candidates: Optional[List[int]] = None) -> List[Dict]:
+        """重み比 r = fitness_weight / preference_weight と最適ランキングの対応を厳密に計算
+
+        各ランキングの目的関数は preference_weight で割ると
+        preference_distance + r * fitness_distance という r の1次関数なので、
+        最適値は r について区分線形（下側包絡線）になる。グリッド探索の代わりに
+        Eisner-Severance 法で包絡線を辿り、隣り合う直線の交点 r* で厳密ソルバーを
+        1回解いて新しい直線が見つかるかを調べる（ソルバー呼び出しは区間数の約3倍）。
+        r* は有理数なので、重みを整数比 (分母, 分子) にして解き、比較も整数で厳密に行う。
+        主観選好がどのフィット度の重み（gap モードでは差分）から覆されるかを
+        r を1つずつ試さずに求められる。
+
+        Args:
+            subjective_preference: 主観的選好ランキング（単一またはプロファイル）
+            fitness_scores: 客観的フィット度スコア（整数のみ）
+            candidates: 候補者のリスト（省略時は0からN-1）
+
+        Returns:
+            List[Dict]: r の小さい順の区間。各要素は
+                - 'ratio_from' / 'ratio_to': 区間 (ratio_from, ratio_to) の端点（Fraction、
+                  最後の区間の ratio_to は None = 無限大）。端点では両側のランキングが同点
+                - 'ranking': 区間内の r で aggregate_preferences が返す最適ランキング
+                - 'preference_distance' / 'fitness_distance': そのランキングの各距離
+
+        Raises:
+            ValueError: solver が厳密解法でない場合
+        """
+        if self.solver not in self.EXACT_SOLVERS:
+            raise ValueError(f"weight_breakpoints には厳密解法 {self.EXACT_SOLVERS} が必要です")
+
+        candidates, voters, _, validated_fitness_scores = self._prepare_inputs(
+            subjective_preference, fitness_scores, candidates
+        )
+        base = PairwiseCostMatrix.build(
+            candidates, voters, validated_fitness_scores, self.fitness_mode
+        )
+        seeds = self._seed_orders(candidates, voters, validated_fitness_scores)
+
+        def solve(preference_weight: int, fitness_weight: int) -> Tuple[List[int], Tuple[int, int]]:
+            matrix = PairwiseCostMatrix(base.preference_cost, base.fitness_cost,
+                                        preference_weight, fitness_weight)
+            order, _, _ = self._run_solver(candidates, matrix, seeds)
+            return order, (base.preference_distance(order), int(base.fitness_distance(order)))
+
+        # r → +0 では preference_distance 最小（同値ならフィット度距離最小）、
+        # r → ∞ ではその逆の辞書式最適。距離の総和+1 を重みにして1回で解く
+        _, left = solve(int(base.fitness_cost.sum()) + 1, 1)
+        _, right = solve(1, int(base.preference_cost.sum()) + 1)
+
+        breakpoints: List[Fraction] = []
+        stack = [(left, right)]
+        while stack:
+            line_a, line_b = stack.pop()
+            if line_a[1] <= line_b[1] and line_a[0] >= line_b[0]:
+                continue
+            numerator = line_b[0] - line_a[0]
+            denominator = line_a[1] - line_b[1]
+            _, line_c = solve(denominator, numerator)
+            value_a = denominator * line_a[0] + numerator * line_a[1]
+            value_c = denominator * line_c[0] + numerator * line_c[1]
+            if value_c < value_a:
+                stack.append((line_a, line_c))
+                stack.append((line_c, line_b))
             else:
-                preference_distance = self.kemeny_distance(perm_list, subjective_preference)  # type: ignore
-            
-            # 客観的フィット度との不一致（整数のみ）
-            fitness_distance = self.fitness_distance(perm_list, validated_fitness_scores)
-            
-            # 総合スコア（重み付き和）
-            total_score = (self.preference_weight * preference_distance + 
-                          self.fitness_weight * fitness_distance)
-            
-            # 計算詳細を記録
-            details = {
-                'ranking': perm_list.copy(),
+                breakpoints.append(Fraction(numerator, denominator))
+        breakpoints.sort()
+
+        # 各区間の内点で解き直し、aggregate_preferences と同じタイブレークの解を得る
+        bounds = [Fraction(0)] + breakpoints + [None]
+        segments = []
+        for ratio_from, ratio_to in zip(bounds[:-1], bounds[1:]):
+            if ratio_to is None:
+                ratio = ratio_from + 1
+            else:
+                ratio = (ratio_from + ratio_to) / 2
+            order, (preference_distance, fitness_distance) = solve(ratio.denominator,
+                                                                   ratio.numerator)
+            segments.append({
+                'ratio_from': ratio_from,
+                'ratio_to': ratio_to,
+                'ranking': [candidates[x] for x in order],
                 'preference_distance': preference_distance,
-                'fitness_distance': fitness_distance,
-                'total_score': total_score
-            }
-            calculation_details.append(details)
-            
-            # 最小スコアの更新（同点の場合は主観的選好を優先）
-            if total_score < best_score:
-                best_score = total_score
-                best_ranking = perm_list.copy()
-            elif total_score == best_score:
-                # タイブレーク: プロファイル/単一いずれの場合も preference_distance が小さい方
-                if best_ranking:
-                    if is_profile:
-                        current_pd = self.kemeny_distance_profile(best_ranking, pref_profile)
-                    else:
-                        current_pd = self.kemeny_distance(best_ranking, subjective_preference)  # type: ignore
-                    if preference_distance < current_pd:
-                        best_score = total_score
-                        best_ranking = perm_list.copy()
-                best_score = total_score
-                best_ranking = perm_list.copy()
-        
-        # 計算詳細をスコア順にソート
-        calculation_details.sort(key=lambda x: (x['total_score'], x['preference_distance']))
+                'fitness_distance': fitness_distance
+            })
+        return segments
+
+    def _aggregate_with_matrix(self, candidates: List[int], matrix: 'PairwiseCostMatrix',
+                               seeds: List[List[int]],
+                               preference_profile: Optional[List[List[int]]],
+                               warm_start: Optional[List[int]] = None,
+                               deadline: Optional[float] = None) -> Tuple[List[int], Dict]:
+        """構築済みのペアコスト表に対して設定されたソルバーを実行し、計算詳細をまとめる"""
+        if self.cache_size > 0 and warm_start is None:
+            best_order, calculation_details, solver_stats, cache_hit = self._solve_cached(
+                candidates, matrix, seeds, deadline
+            )
+        else:
+            best_order, calculation_details, solver_stats = self._run_solver(
+                candidates, matrix, seeds, warm_start, deadline
+            )
+            cache_hit = False
+
+        best_ranking = [candidates[x] for x in best_order]
+        if calculation_details is None:
+            calculation_details = [self._calculation_entry(candidates, best_order, matrix)]
+        best_score = self._calculation_entry(candidates, best_order, matrix)['total_score']
+        timed_out = bool(solver_stats.get('timed_out', False))
+        exact = (self.solver in self.EXACT_SOLVERS and not timed_out and
+                 'shortlist' not in solver_stats)
+        # 厳密解なら最適値そのもの、そうでなければペアごとの最小コストの和が下界
+        lower_bound = best_score if exact else min(best_score, matrix.lower_bound())
         
         result_details = {
             'best_ranking': best_ranking,
@@ -256,10 +1004,694 @@ class ExtendedKemenyRule:
             'preference_weight': self.preference_weight,
             'fitness_weight': self.fitness_weight,
             'fitness_mode': self.fitness_mode,
-            'preference_profile': pref_profile if is_profile else None
+            'preference_profile': preference_profile,
+            'solver': self.solver,
+            'exact': exact,
+            'timed_out': timed_out,
+            'lower_bound': lower_bound,
+            'optimality_gap': best_score - lower_bound,
+            'solver_stats': solver_stats
         }
+        if self.cache_size > 0 and warm_start is None:
+            result_details['cache_hit'] = cache_hit
         
         return best_ranking, result_details
+
+    def cache_info(self) -> Dict:
+        """集約結果キャッシュの統計（ヒット・ミス・追い出し回数と現在の件数）"""
+        return dict(self._cache_stats, size=len(self._cache), max_size=self.cache_size)
+
+    def clear_cache(self):
+        """集約結果キャッシュと統計を初期化"""
+        self._cache.clear()
+        self._cache_stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+
+    def estimate_cost(self, n_candidates: int) -> float:
+        """候補者数 n の集約1回の計算量の目安（ジョブの並べ替え・分割用の相対値）
+
+        brute_force は n!・n^2、dp / branch_and_bound は 2^n・n^2（最悪時）、
+        local_search は n^3。shortlist 指定時は厳密に解く部分を K 人に抑え、
+        得点計算の n^2 を加える。
+        """
+        n = n_candidates
+        if self.shortlist is not None and n > self.shortlist:
+            return self.estimate_cost(self.shortlist) + float(n * n)
+        if self.solver == "brute_force":
+            return float(math.factorial(n)) * n * n
+        if self.solver in ("dp", "branch_and_bound"):
+            return math.ldexp(float(n * n), n)
+        return float(n ** 3)
+
+    def _solve_cached(self, candidates: List[int], matrix: 'PairwiseCostMatrix',
+                      seeds: List[List[int]],
+                      deadline: Optional[float] = None
+                      ) -> Tuple[List[int], Optional[List[Dict]], Dict, bool]:
+        """標準形をキーにキャッシュを引き、なければ元のラベルで解いて登録する
+
+        標準形: 先頭の初期解（主観的選好、なければフィット度順）の k 番目の候補を
+        ラベル k とし、コスト表と全初期解をこのラベルで表したもの。
+        未登録時はキャッシュ無効時と同じく元のラベルのまま解くため、結果
+        （同点時のタイブレークを含む）はキャッシュの有無によらない。
+        解は次のどちらかのキーで登録する。
+        - 標準形のキー: 厳密解法の最適解が一意であることが確認済みで、計算詳細
+          （順列の列挙順に依存する）を持たない場合。どのラベルで解いても同じ
+          ランキングになるため、ラベルの付け替えで一致する入力すべてに使う
+        - (標準形のキー, 元のラベルの並び): それ以外の場合。入力がインデックス上で
+          同一のときだけ使う（解き直しても同じ結果になる）
+        期限切れで打ち切った結果は登録しない。
+        """
+        canonical = seeds[0]
+        permutation = tuple(canonical)
+        inverse = [0] * len(canonical)
+        for k, x in enumerate(canonical):
+            inverse[x] = k
+        canonical_matrix = matrix.submatrix(canonical)
+        canonical_seeds = [[inverse[x] for x in seed] for seed in seeds]
+        key = (
+            self.solver, self.decompose, self.details, self.top_k, self.shortlist,
+            tuple(sorted(self.solver_options.items())),
+            self.preference_weight, self.fitness_weight, self.fitness_mode,
+            matrix.n,
+            canonical_matrix.preference_cost.tobytes(),
+            canonical_matrix.fitness_cost.tobytes(),
+            tuple(tuple(seed) for seed in canonical_seeds)
+        )
+
+        exact_key = (key, permutation)
+        hit_key = key if key in self._cache else exact_key
+        cached = self._cache.get(hit_key)
+        if cached is not None:
+            self._cache.move_to_end(hit_key)
+            self._cache_stats['hits'] += 1
+            canonical_order, canonical_details, solver_stats = cached
+            best_order = [canonical[k] for k in canonical_order]
+            calculation_details = None
+            if canonical_details is not None:
+                calculation_details = [
+                    dict(entry, ranking=[candidates[canonical[k]] for k in entry['ranking']])
+                    for entry in canonical_details
+                ]
+            return best_order, calculation_details, copy.deepcopy(solver_stats), True
+
+        self._cache_stats['misses'] += 1
+        best_order, calculation_details, solver_stats = self._run_solver(
+            candidates, matrix, seeds, deadline=deadline
+        )
+        if not solver_stats.get('timed_out', False):
+            index_of = {c: i for i, c in enumerate(candidates)}
+            canonical_details = None
+            if calculation_details is not None:
+                canonical_details = [
+                    dict(entry, ranking=[inverse[index_of[c]] for c in entry['ranking']])
+                    for entry in calculation_details
+                ]
+            relabel_safe = (
+                self.solver in self.EXACT_SOLVERS and calculation_details is None and
+                'shortlist' not in solver_stats and
+                (solver_stats.get('unique_optimum', False) or
+                 all(len(component) == 1 for component in matrix.condorcet_components()))
+            )
+            self._cache[key if relabel_safe else exact_key] = (
+                [inverse[x] for x in best_order], canonical_details, copy.deepcopy(solver_stats)
+            )
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+                self._cache_stats['evictions'] += 1
+        return best_order, calculation_details, solver_stats, False
+
+    def _run_solver(self, candidates: List[int], matrix: 'PairwiseCostMatrix',
+                    seeds: List[List[int]],
+                    warm_start: Optional[List[int]] = None,
+                    deadline: Optional[float] = None
+                    ) -> Tuple[List[int], Optional[List[Dict]], Dict]:
+        """設定されたソルバー（必要なら候補の絞り込みつき）を実行"""
+        if self.shortlist is not None and matrix.n > self.shortlist:
+            return self._solve_shortlist(candidates, matrix, seeds, warm_start, deadline)
+        return self._dispatch_solver(candidates, matrix, seeds, warm_start, deadline)
+
+    def _dispatch_solver(self, candidates: List[int], matrix: 'PairwiseCostMatrix',
+                         seeds: List[List[int]],
+                         warm_start: Optional[List[int]] = None,
+                         deadline: Optional[float] = None
+                         ) -> Tuple[List[int], Optional[List[Dict]], Dict]:
+        """設定されたソルバー（必要なら Condorcet 分解つき）を実行"""
+        if self.solver == "dp":
+            solve = self._solve_dp
+        elif self.solver == "branch_and_bound":
+            solve = self._solve_branch_and_bound
+        elif self.solver == "local_search":
+            solve = self._solve_local_search
+        else:
+            solve = self._solve_brute_force
+        if self.decompose and self.solver in ("dp", "branch_and_bound"):
+            return self._solve_decomposed(solve, candidates, matrix, seeds, warm_start, deadline)
+        return solve(candidates, matrix, seeds, warm_start, deadline)
+
+    def _solve_shortlist(self, candidates: List[int], matrix: 'PairwiseCostMatrix',
+                         seeds: List[List[int]],
+                         warm_start: Optional[List[int]] = None,
+                         deadline: Optional[float] = None
+                         ) -> Tuple[List[int], Optional[List[Dict]], Dict]:
+        """Borda 型の得点上位 shortlist 人だけを厳密に解き、残りを得点順に連結する
+
+        得点は cost[x, :] の行和（x を他の全員より前に置くコストで、主観的選好と
+        フィット度の両方を重み付きで含む）。上位集合 S の全員が残り T の全員に
+        cost[s, t] <= cost[t, s] で負けないなら、任意のランキングで T の要素を
+        S より前に出してもスコアは下がらないため、S を先頭に並べた最適解が存在し、
+        S 内の順序はその部分問題の最適解と一致する。
+        """
+        n = matrix.n
+        borda = sorted(range(n), key=lambda x: (matrix.cost[x].sum(), -x))
+        # 部分問題の局所番号は元のインデックス昇順（タイブレークを全体と揃える）
+        head = sorted(borda[:self.shortlist])
+        tail = borda[self.shortlist:]
+
+        local_index = {x: i for i, x in enumerate(head)}
+        local_seeds = [[local_index[x] for x in seed if x in local_index] for seed in seeds]
+        local_warm_start = None
+        if warm_start is not None:
+            local_warm_start = [local_index[x] for x in warm_start if x in local_index]
+        local_order, _, stats = self._dispatch_solver(
+            [candidates[x] for x in head], matrix.submatrix(head), local_seeds,
+            local_warm_start, deadline
+        )
+
+        head_index = np.asarray(head, dtype=np.intp)
+        tail_index = np.asarray(tail, dtype=np.intp)
+        head_cost = matrix.cost[np.ix_(head_index, tail_index)]
+        tail_cost = matrix.cost[np.ix_(tail_index, head_index)].T
+        shortlist_optimal = bool(np.all(head_cost <= tail_cost + matrix.tie_tolerance()))
+
+        shortlist_stats = {
+            'shortlist': [candidates[x] for x in head],
+            'shortlist_optimal': shortlist_optimal and self.solver in self.EXACT_SOLVERS,
+            'shortlist_solver_stats': stats
+        }
+        if stats.get('timed_out', False):
+            shortlist_stats['timed_out'] = True
+            shortlist_stats['shortlist_optimal'] = False
+        return [head[x] for x in local_order] + tail, None, shortlist_stats
+
+    def _calculation_entry(self, candidates: List[int], order: Sequence[int],
+                           matrix: 'PairwiseCostMatrix') -> Dict:
+        """1つのランキングの計算詳細（全探索と同じ形式）を作成"""
+        preference_distance = matrix.preference_distance(order)
+        fitness_distance = float(matrix.fitness_distance(order))
+        return {
+            'ranking': [candidates[x] for x in order],
+            'preference_distance': preference_distance,
+            'fitness_distance': fitness_distance,
+            'total_score': (self.preference_weight * preference_distance +
+                            self.fitness_weight * fitness_distance)
+        }
+
+    def _seed_orders(self, candidates: List[int], voters: Sequence[Sequence[int]],
+                     fitness_scores: List[int]) -> List[List[int]]:
+        """初期解候補（候補者インデックス列）: 主観的選好とフィット度順"""
+        index_of = {c: i for i, c in enumerate(candidates)}
+        seeds = []
+        for pref in voters:
+            if len(pref) == len(candidates) and set(pref) == set(index_of):
+                seeds.append([index_of[c] for c in pref])
+        seeds.append(sorted(range(len(candidates)),
+                            key=lambda i: fitness_scores[i], reverse=True))
+        return seeds
+
+    def _timeout_order(self, matrix: 'PairwiseCostMatrix', seeds: List[List[int]],
+                       deadline: Optional[float] = None) -> List[int]:
+        """期限切れ時の解: 最良の初期解（期限が残っていれば局所探索で改善したもの）
+
+        局所探索は期限を反復ごとに確認するため、期限を過ぎていれば初期解をそのまま返す。
+        """
+        order = list(min(seeds, key=matrix.order_cost))
+        if not self._expired(deadline):
+            self._local_search(order, matrix.cost.tolist(),
+                               int(self.solver_options.get('max_iterations', 1000)), deadline)
+        return order
+
+    def _solve_decomposed(self, solve, candidates: List[int], matrix: 'PairwiseCostMatrix',
+                          seeds: List[List[int]],
+                          warm_start: Optional[List[int]] = None,
+                          deadline: Optional[float] = None
+                          ) -> Tuple[List[int], Optional[List[Dict]], Dict]:
+        """Condorcet 成分ごとに厳密解法を適用し、成分順に連結する
+
+        成分内のインデックスは昇順のまま局所番号に振り直すため、
+        各成分で辞書順最大の最適解を連結したものが全体でも辞書順最大の最適解となり、
+        タイブレークも分解しない場合と一致する。
+        """
+        components = matrix.condorcet_components()
+        if len(components) <= 1:
+            return solve(candidates, matrix, seeds, warm_start, deadline)
+
+        best_order: List[int] = []
+        component_stats = []
+        for component in components:
+            local_index = {x: i for i, x in enumerate(component)}
+            local_seeds = [[local_index[x] for x in seed if x in local_index] for seed in seeds]
+            local_warm_start = None
+            if warm_start is not None:
+                local_warm_start = [local_index[x] for x in warm_start if x in local_index]
+            local_order, _, stats = solve(
+                [candidates[x] for x in component], matrix.submatrix(component), local_seeds,
+                local_warm_start, deadline
+            )
+            best_order.extend(component[x] for x in local_order)
+            component_stats.append(stats)
+
+        stats = {
+            'components': [len(component) for component in components],
+            'component_stats': component_stats
+        }
+        if any(s.get('timed_out', False) for s in component_stats):
+            stats['timed_out'] = True
+        if all('unique_optimum' in s for s in component_stats):
+            # 成分間は厳密に優越するため、各成分の最適解が一意なら全体も一意
+            stats['unique_optimum'] = all(s['unique_optimum'] for s in component_stats)
+        return best_order, None, stats
+
+    def _solve_brute_force(self, candidates: List[int], matrix: 'PairwiseCostMatrix',
+                           seeds: List[List[int]],
+                           warm_start: Optional[List[int]] = None,
+                           deadline: Optional[float] = None) -> Tuple[List[int], List[Dict], Dict]:
+        """全順列を列挙して最適ランキングを求める（従来方式）
+
+        順列はジェネレータから一定数ずつ取り出して2次元配列にし、
+        ペアコスト表から距離を一括計算する。details="top_k" の場合は
+        (総合スコア, 主観距離, 列挙順) の上位 top_k 件だけを有界ヒープに
+        インデックス列のタプルで保持し、全順列分の辞書は作らない。
+        期限を過ぎたらチャンク単位で列挙を打ち切り、初期解の局所探索結果と比べて
+        良い方を返す。
+        """
+        n = matrix.n
+        pairs = max(1, n * (n - 1) // 2)
+        chunk_size = max(1, self.BRUTE_FORCE_CHUNK_ELEMENTS // pairs)
+        permutations = itertools.permutations(range(n))
+        keep_all = self.details == "all"
+
+        best_order: List[int] = []
+        best_score = float('inf')
+        calculation_details = []
+        # 最大ヒープ（符号反転）: (-総合スコア, -主観距離, -列挙順, 順列, フィット距離)
+        top_heap: List[Tuple[float, int, int, Tuple[int, ...], float]] = []
+        n_permutations = 0
+        timed_out = False
+
+        while True:
+            if self._expired(deadline):
+                timed_out = True
+                break
+            chunk = list(itertools.islice(permutations, chunk_size))
+            if not chunk:
+                break
+            orders = np.array(chunk, dtype=np.intp).reshape(len(chunk), n)
+            preference_distances, fitness_distances = matrix.distances_many(orders)
+            fitness_distances = fitness_distances.astype(np.float64)
+            total_scores = (matrix.preference_weight * preference_distances +
+                            matrix.fitness_weight * fitness_distances)
+
+            # 最小スコアの更新（従来実装どおり、同点の場合は列挙順で後の順列を採用）
+            chunk_best = float(total_scores.min())
+            if chunk_best <= best_score:
+                last = len(chunk) - 1 - int(np.argmin(total_scores[::-1]))
+                best_score = chunk_best
+                best_order = list(chunk[last])
+
+            if keep_all:
+                # 計算詳細を記録
+                for order, preference_distance, fitness_distance, total_score in zip(
+                        chunk, preference_distances.tolist(), fitness_distances.tolist(),
+                        total_scores.tolist()):
+                    calculation_details.append({
+                        'ranking': [candidates[x] for x in order],
+                        'preference_distance': preference_distance,
+                        'fitness_distance': fitness_distance,
+                        'total_score': total_score
+                    })
+            else:
+                rows = np.arange(len(chunk))
+                if len(top_heap) >= self.top_k:
+                    # ヒープ内の最悪スコア以下の行だけを候補にする
+                    rows = np.flatnonzero(total_scores <= -top_heap[0][0])
+                for row in rows.tolist():
+                    key = (-float(total_scores[row]), -int(preference_distances[row]),
+                           -(n_permutations + row), chunk[row], float(fitness_distances[row]))
+                    if len(top_heap) < self.top_k:
+                        heapq.heappush(top_heap, key)
+                    elif key > top_heap[0]:
+                        heapq.heapreplace(top_heap, key)
+            n_permutations += len(chunk)
+        
+        if keep_all:
+            # 計算詳細をスコア順にソート
+            calculation_details.sort(key=lambda x: (x['total_score'], x['preference_distance']))
+        else:
+            for neg_total, neg_pd, _, order, fitness_distance in sorted(top_heap, reverse=True):
+                calculation_details.append({
+                    'ranking': [candidates[x] for x in order],
+                    'preference_distance': -neg_pd,
+                    'fitness_distance': fitness_distance,
+                    'total_score': -neg_total
+                })
+        
+        stats = {'permutations': n_permutations}
+        if timed_out:
+            stats['timed_out'] = True
+            fallback = self._timeout_order(matrix, seeds, deadline)
+            if n_permutations == 0 or matrix.order_cost(fallback) < best_score:
+                best_order = fallback
+        return best_order, calculation_details, stats
+
+    def _solve_dp(self, candidates: List[int], matrix: 'PairwiseCostMatrix',
+                  seeds: List[List[int]],
+                  warm_start: Optional[List[int]] = None,
+                  deadline: Optional[float] = None) -> Tuple[List[int], Optional[List[Dict]], Dict]:
+        """部分集合DPで最適ランキングを求める（厳密解）
+
+        g[R] = 未配置の候補集合 R を並べる最小コスト とし、
+        g[R] = min_{x∈R} ( Σ_{y∈R-{x}} cost[x, y] + g[R-{x}] ) を
+        要素数の少ない集合から順に NumPy で一括計算する（期限を過ぎたら打ち切り、
+        初期解の局所探索結果を返す）。
+        Σ_{y∈R-{x}} cost[x, y] は候補を上位/下位の2グループに分けた
+        部分和表の和として引くため、追加メモリは O(n・2^(n/2)) で済む。
+
+        同点時は全探索と同じ結果（itertools.permutations の列挙順で
+        最後に現れる順列）を返すよう、各集合で最大インデックスの先頭候補を選ぶ。
+        """
+        n = matrix.n
+        if n > self.DP_MAX_CANDIDATES:
+            raise ValueError(
+                f"dp ソルバーの候補者数上限を超えています: {n} > {self.DP_MAX_CANDIDATES}"
+            )
+        if n == 0:
+            return [], None, {'states': 1, 'unique_optimum': True}
+
+        cost = matrix.cost
+
+        # 部分和表: low_sums[x][m] = Σ_{bit y∈m} cost[x, y]（下位 half ビット）
+        half = n // 2
+        low_mask = (1 << half) - 1
+        low_sums = []
+        high_sums = []
+        for x in range(n):
+            low = np.zeros(1, dtype=np.float64)
+            for y in range(half):
+                low = np.concatenate([low, low + cost[x, y]])
+            high = np.zeros(1, dtype=np.float64)
+            for y in range(half, n):
+                high = np.concatenate([high, high + cost[x, y]])
+            low_sums.append(low)
+            high_sums.append(high)
+
+        popcount = np.zeros(1, dtype=np.uint8)
+        for _ in range(n):
+            popcount = np.concatenate([popcount, popcount + 1])
+
+        tolerance = matrix.tie_tolerance()
+        g = np.full(1 << n, np.inf, dtype=np.float64)
+        g[0] = 0.0
+        parent = np.zeros(1 << n, dtype=np.int8)
+
+        for k in range(1, n + 1):
+            masks = np.flatnonzero(popcount == k)
+            best = np.full(len(masks), np.inf, dtype=np.float64)
+            best_first = np.zeros(len(masks), dtype=np.int8)
+            for x in range(n):
+                if self._expired(deadline):
+                    return self._timeout_order(matrix, seeds, deadline), None, {
+                        'states': 1 << n, 'timed_out': True
+                    }
+                idx = np.flatnonzero(masks & (1 << x))
+                rest = masks[idx] ^ (1 << x)
+                cand = low_sums[x][rest & low_mask] + high_sums[x][rest >> half] + g[rest]
+                # 同点（許容誤差内）なら大きいインデックスを優先
+                current = best[idx]
+                better = cand <= current + tolerance
+                best[idx[better]] = np.minimum(cand[better], current[better])
+                best_first[idx[better]] = x
+            g[masks] = best
+            parent[masks] = best_first
+
+        # 復元経路の各集合で最小値を取る先頭候補が1つだけなら、最適解は一意
+        order = []
+        unique_optimum = True
+        remaining = (1 << n) - 1
+        while remaining:
+            if unique_optimum:
+                ties = 0
+                for y in range(n):
+                    if remaining & (1 << y):
+                        rest = remaining ^ (1 << y)
+                        value = low_sums[y][rest & low_mask] + high_sums[y][rest >> half] + g[rest]
+                        if value <= g[remaining] + tolerance:
+                            ties += 1
+                unique_optimum = ties == 1
+            x = int(parent[remaining])
+            order.append(x)
+            remaining ^= 1 << x
+
+        return order, None, {'states': 1 << n, 'unique_optimum': unique_optimum}
+
+    def _solve_branch_and_bound(self, candidates: List[int], matrix: 'PairwiseCostMatrix',
+                                seeds: List[List[int]],
+                                warm_start: Optional[List[int]] = None,
+                                deadline: Optional[float] = None) -> Tuple[List[int], Optional[List[Dict]], Dict]:
+        """分枝限定法で最適ランキングを求める（厳密解）
+
+        先頭から1つずつ候補を確定する深さ優先探索。未配置ペアの
+        min(cost[a,b], cost[b,a]) の総和を下界とし、暫定解を超える枝を刈る。
+        暫定解は主観的選好とフィット度順（warm_start があればそれも）から初期化する。
+        同点時は全探索と同じ順列（列挙順で最後 = インデックス列が辞書順最大）を返す。
+        期限を過ぎたら探索を打ち切り、その時点の暫定解を返す。
+        """
+        n = matrix.n
+        cost = matrix.cost.tolist()
+        pair_min = np.minimum(matrix.cost, matrix.cost.T).tolist()
+
+        tolerance = matrix.tie_tolerance()
+
+        def improves(score: float, order: List[int]) -> bool:
+            # 全探索と同じく、同点なら辞書順で大きいインデックス列を採用
+            if score < best_score - tolerance:
+                return True
+            return score <= best_score + tolerance and order > best_order
+
+        if warm_start is not None:
+            seeds = [warm_start] + seeds
+
+        best_order: List[int] = []
+        best_score = float('inf')
+        for seed in seeds:
+            seed_score = matrix.order_cost(seed)
+            if improves(seed_score, seed):
+                best_score = seed_score
+                best_order = seed
+        seed_score = best_score
+
+        # row_cost[x] = Σ_{y∈R-{x}} cost[x,y], row_min[x] = Σ_{y∈R-{x}} pair_min[x,y]
+        row_cost = [sum(cost[x]) - cost[x][x] for x in range(n)]
+        row_min = [sum(pair_min[x]) - pair_min[x][x] for x in range(n)]
+        root_bound = sum(row_min) / 2
+        stats = {'nodes_explored': 0, 'nodes_pruned': 0}
+        timed_out = False
+
+        def dfs(prefix: List[int], remaining: List[int], current: float,
+                row_cost: List[float], row_min: List[float], remaining_bound: float):
+            nonlocal best_order, best_score, timed_out
+            # 1ノードの展開は O(n^2) なので、期限の確認はノードごとに行う
+            if timed_out or self._expired(deadline):
+                timed_out = True
+                return
+            stats['nodes_explored'] += 1
+            if not remaining:
+                if improves(current, prefix):
+                    best_score = min(current, best_score)
+                    best_order = prefix
+                return
+
+            depth = len(prefix)
+            children = sorted(
+                (current + row_cost[x] + remaining_bound - row_min[x], -x, x)
+                for x in remaining
+            )
+            for bound, _, x in children:
+                if timed_out:
+                    return
+                child_prefix = prefix + [x]
+                # 下界が暫定解を超える、または同点でも辞書順で暫定解を上回れない枝は刈る
+                if bound > best_score + tolerance or (
+                        bound >= best_score - tolerance and
+                        child_prefix < best_order[:depth + 1]):
+                    stats['nodes_pruned'] += 1
+                    continue
+                child_remaining = [y for y in remaining if y != x]
+                child_row_cost = row_cost[:]
+                child_row_min = row_min[:]
+                for y in child_remaining:
+                    child_row_cost[y] -= cost[y][x]
+                    child_row_min[y] -= pair_min[y][x]
+                dfs(child_prefix, child_remaining, current + row_cost[x],
+                    child_row_cost, child_row_min, remaining_bound - row_min[x])
+
+        dfs([], list(range(n)), 0.0, row_cost, row_min, root_bound)
+
+        stats.update({
+            'root_lower_bound': root_bound,
+            'seed_score': seed_score,
+            'proven_optimal': not timed_out
+        })
+        if timed_out:
+            stats['timed_out'] = True
+        return best_order, None, stats
+
+    @staticmethod
+    def _local_search(order: List[int], cost: List[List[float]],
+                      max_iterations: int,
+                      deadline: Optional[float] = None) -> Tuple[float, int, int]:
+        """隣接交換と挿入移動による局所探索（order をその場で改善）
+
+        いずれの移動もペアコスト表から差分だけを計算する。隣接交換は O(1)、
+        挿入移動は移動先を1つずらすごとに O(1) で差分を更新する。
+        deadline（time.monotonic() 基準）を過ぎたら反復の区切りで打ち切る。
+
+        Returns:
+            Tuple[float, int, int]: スコア改善量（負値）、反復回数、採用した移動数
+        """
+        n = len(order)
+        gain = 0.0
+        iterations = 0
+        moves = 0
+        improved = True
+        while improved and iterations < max_iterations:
+            if deadline is not None and time.monotonic() >= deadline:
+                break
+            improved = False
+            iterations += 1
+
+            # 隣接交換: order[i], order[i+1] を入れ替える差分は O(1)
+            for i in range(n - 1):
+                a, b = order[i], order[i + 1]
+                delta = cost[b][a] - cost[a][b]
+                if delta < 0:
+                    order[i], order[i + 1] = b, a
+                    gain += delta
+                    moves += 1
+                    improved = True
+
+            # 挿入移動: order[i] を最良の位置へ移す
+            for i in range(n):
+                x = order[i]
+                row = cost[x]
+                best_delta = 0.0
+                best_j = i
+                delta = 0.0
+                for j in range(i - 1, -1, -1):
+                    y = order[j]
+                    delta += row[y] - cost[y][x]
+                    if delta < best_delta:
+                        best_delta = delta
+                        best_j = j
+                delta = 0.0
+                for j in range(i + 1, n):
+                    y = order[j]
+                    delta += cost[y][x] - row[y]
+                    if delta < best_delta:
+                        best_delta = delta
+                        best_j = j
+                if best_j != i:
+                    order.pop(i)
+                    order.insert(best_j, x)
+                    gain += best_delta
+                    moves += 1
+                    improved = True
+        return gain, iterations, moves
+
+    def _solve_local_search(self, candidates: List[int], matrix: 'PairwiseCostMatrix',
+                            seeds: List[List[int]],
+                            warm_start: Optional[List[int]] = None,
+                            deadline: Optional[float] = None) -> Tuple[List[int], Optional[List[Dict]], Dict]:
+        """局所探索で近似最適ランキングを求める（厳密解の保証なし）
+
+        Borda（ペアコスト表の行和）・フィット度順・主観的選好を初期解とし、
+        それぞれ局所最適まで改善する（warm_start があればそれだけを初期解にする）。
+        solver_options["restarts"] > 0 の場合は
+        最良解から焼きなましで摂動して再度局所探索する。
+        期限を過ぎたら初期解・再出発の区切りで打ち切る。
+        """
+        n = matrix.n
+        options = self.solver_options
+        max_iterations = int(options.get('max_iterations', 1000))
+        restarts = int(options.get('restarts', 0))
+        anneal_steps = int(options.get('anneal_steps', 20 * n))
+        rng = random.Random(options.get('random_seed', 0))
+
+        cost_matrix = matrix.cost
+        cost = cost_matrix.tolist()
+
+        if warm_start is not None:
+            # 前回の最適解から再最適化する（差分更新時）
+            seeds = [warm_start]
+        else:
+            # Borda 型の初期解: 他の全候補より前に置くコストが小さい順
+            borda_seed = sorted(range(n), key=lambda x: (cost_matrix[x].sum(), -x))
+            seeds = [borda_seed] + seeds
+
+        best_order: List[int] = []
+        best_score = float('inf')
+        total_iterations = 0
+        total_moves = 0
+        seed_scores = []
+        for seed in seeds:
+            if best_order and self._expired(deadline):
+                break
+            order = list(seed)
+            score = matrix.order_cost(order)
+            seed_scores.append(score)
+            gain, iterations, moves = self._local_search(order, cost, max_iterations, deadline)
+            total_iterations += iterations
+            total_moves += moves
+            score += gain
+            if score < best_score or (score == best_score and order > best_order):
+                best_score = score
+                best_order = order
+
+        # 焼きなましによる再出発
+        asymmetry = np.abs(cost_matrix - cost_matrix.T)
+        initial_temperature = float(asymmetry.sum() / max(1, n * (n - 1))) or 1.0
+        for _ in range(restarts if n > 1 else 0):
+            if self._expired(deadline):
+                break
+            order = best_order[:]
+            score = best_score
+            for step in range(anneal_steps):
+                temperature = initial_temperature * (0.01 ** (step / max(1, anneal_steps)))
+                i, j = rng.sample(range(n), 2)
+                x = order[i]
+                if j < i:
+                    delta = sum(cost[x][y] - cost[y][x] for y in order[j:i])
+                else:
+                    delta = sum(cost[y][x] - cost[x][y] for y in order[i + 1:j + 1])
+                if delta <= 0 or rng.random() < math.exp(-delta / temperature):
+                    order.pop(i)
+                    order.insert(j, x)
+                    score += delta
+            gain, iterations, moves = self._local_search(order, cost, max_iterations, deadline)
+            total_iterations += iterations
+            total_moves += moves
+            score += gain
+            if score < best_score or (score == best_score and order > best_order):
+                best_score = score
+                best_order = order
+
+        stats = {
+            'iterations': total_iterations,
+            'moves': total_moves,
+            'restarts': restarts,
+            'seed_scores': seed_scores
+        }
+        if self._expired(deadline):
+            stats['timed_out'] = True
+        return best_order, None, stats
     
     def print_calculation_details(self, details: Dict):
         """
@@ -273,6 +1705,9 @@ class ExtendedKemenyRule:
         print(f"客観的フィット度の重み: {details['fitness_weight']}")
         print(f"最適ランキング: {details['best_ranking']}")
         print(f"最小スコア: {details['best_score']}")
+        if details.get('timed_out') or details.get('optimality_gap', 0) > 0:
+            print(f"下界: {details['lower_bound']} (ギャップ: {details['optimality_gap']}"
+                  f"{', 時間切れ' if details.get('timed_out') else ''})")
         print()
         
         print("全候補の評価:")
@@ -284,8 +1719,10 @@ class ExtendedKemenyRule:
             print(f"{ranking_str}\t\t{calc['preference_distance']}\t\t"
                   f"{calc['fitness_distance']}\t\t{calc['total_score']}")
             
-        if len(details['all_calculations']) > 10:
-            print(f"... (他{len(details['all_calculations']) - 10}候補)")
+        n_evaluated = details.get('solver_stats', {}).get(
+            'permutations', len(details['all_calculations']))
+        if n_evaluated > 10:
+            print(f"... (他{n_evaluated - 10}候補)")
 
 
 def demo_extended_kemeny():
@@ -316,6 +1753,16 @@ def demo_extended_kemeny():
     print("=== 結果解釈 ===")
     print(f"統合された最適ランキング: {best_ranking}")
     print("これは論文で示された213（ケアワーカー2>1>0の順）と一致することを確認")
+    
+    print()
+    print("=== 集約結果キャッシュ ===")
+    # フィット度が主観的選好と真逆のため全順列が同点（最適解が一意でない）入力
+    cached_rule = ExtendedKemenyRule(cache_size=8)
+    for _ in range(2):
+        cached_rule.aggregate_preferences([0, 1, 2], [1, 3, 5])
+    info = cached_rule.cache_info()
+    print(f"同じ入力を2回集約: ヒット {info['hits']} 回、ミス {info['misses']} 回")
+    assert info['hits'] == 1, "同一の入力はキャッシュから返されるはずです"
 
 
 if __name__ == "__main__":
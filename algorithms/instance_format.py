@@ -0,0 +1,311 @@
+#!/usr/bin/env python3
+"""
+マッチング問題インスタンスのバイナリ形式
+
+被介護者・ケアワーカーの主観的選好（選好順と順位）、客観的フィット度、容量、
+ID の対応表を、配列ごとの .npy ファイルとメタ情報 meta.json を置いたディレクトリとして
+保存します。読み込みは np.load の mmap_mode によるメモリマップで行うため、
+大きな名簿でも解析やコピーをせずに利用できます。
+
+CSV 形式（CSVInputHandler の読み込み結果）と generate_sample_data の辞書形式との
+相互変換を提供し、CSVInputHandler はこの形式をファイル内容のハッシュをキーとした
+解析結果のキャッシュとして使います。
+
+Author: 倉持誠 (Makoto Kuramochi)
+"""
+
+import json
+import os
+import shutil
+import tempfile
+from typing import Dict, List, Optional
+import numpy as np
+from validation import ConstraintViolationError
+
+
+class MatchingInstance:
+    """マッチング問題の入力を密な配列で保持するクラス
+
+    被介護者 R 人・ケアワーカー C 人のとき、各配列は次の形:
+
+    - recipient_ids (R,) / caregiver_ids (C,): int64 の ID（インデックス → ID の対応表）
+    - recipient_preferences (R, C): 選好順のケアワーカーインデックス（int32、不足分は -1）
+    - recipient_ranks (R, C): 各ケアワーカーの順位（0始まり、int32、欠損は -1）
+    - recipient_fitness (R, C): フィット度（int64、欠損は -1）
+    - recipient_columns (C,): CSV の列の並び（ケアワーカーインデックス、int32）
+    - caregiver_preferences / caregiver_ranks / caregiver_fitness (C, R) /
+      caregiver_columns (R,): ケアワーカー側の同じ配列
+    - capacities (C,): 容量（int32）
+
+    フィット度は制約により非負の整数なので、欠損は -1 で表す。
+    """
+
+    FORMAT_VERSION = 1
+    ARRAY_NAMES = (
+        'recipient_ids', 'caregiver_ids',
+        'recipient_preferences', 'recipient_ranks', 'recipient_fitness', 'recipient_columns',
+        'caregiver_preferences', 'caregiver_ranks', 'caregiver_fitness', 'caregiver_columns',
+        'capacities',
+    )
+
+    def __init__(self, arrays: Dict[str, np.ndarray], metadata: Optional[Dict] = None):
+        """
+        Args:
+            arrays: ARRAY_NAMES の全ての配列
+            metadata: 付加情報（CSV から変換した場合は 'fitness_scales' など）
+        """
+        missing = [name for name in self.ARRAY_NAMES if name not in arrays]
+        if missing:
+            raise ValueError(f"インスタンスに必要な配列がありません: {missing}")
+        self.arrays = arrays
+        self.metadata = dict(metadata or {})
+
+    def __getattr__(self, name: str) -> np.ndarray:
+        arrays = self.__dict__.get('arrays', {})
+        if name in arrays:
+            return arrays[name]
+        raise AttributeError(name)
+
+    @staticmethod
+    def _side_arrays(agent_ids: List[int], candidate_ids: List[int],
+                     orders: List[List[int]], ranks: List[Dict[int, int]],
+                     fitness: List[Dict[int, int]]) -> Dict[str, np.ndarray]:
+        """片側のエージェントの選好順・順位・フィット度を密な配列に詰める"""
+        candidate_index = {c: j for j, c in enumerate(candidate_ids)}
+        n_agents, n_candidates = len(agent_ids), len(candidate_ids)
+        preferences = np.full((n_agents, n_candidates), -1, dtype=np.int32)
+        rank_array = np.full((n_agents, n_candidates), -1, dtype=np.int32)
+        fitness_array = np.full((n_agents, n_candidates), -1, dtype=np.int64)
+        try:
+            for i in range(n_agents):
+                preferences[i, :len(orders[i])] = [candidate_index[c] for c in orders[i]]
+                if ranks[i]:
+                    rank_array[i, [candidate_index[c] for c in ranks[i]]] = list(ranks[i].values())
+                if fitness[i]:
+                    fitness_array[i, [candidate_index[c] for c in fitness[i]]] = list(fitness[i].values())
+        except KeyError as e:
+            raise ConstraintViolationError(f"相手側に存在しないIDが含まれています: {e.args[0]}") from e
+        return {'preferences': preferences, 'ranks': rank_array, 'fitness': fitness_array}
+
+    @classmethod
+    def from_sample_data(cls, data: Dict) -> 'MatchingInstance':
+        """
+        CareMatchingSystem.generate_sample_data の辞書形式から変換
+
+        Args:
+            data: 'care_recipients', 'caregivers', 'caregiver_capacities',
+                'recipient_subjective_preferences', 'caregiver_subjective_preferences',
+                'fitness_scores'（ケアワーカー順）, 'caregiver_fitness_scores'（被介護者順）を持つ辞書
+        """
+        recipients = list(data['care_recipients'])
+        caregivers = list(data['caregivers'])
+
+        def side(agents, candidates, preferences, fitness_scores):
+            orders = [list(preferences[a]) for a in agents]
+            ranks = [{c: position for position, c in reversed(list(enumerate(order)))}
+                     for order in orders]
+            fitness = [dict(zip(candidates, fitness_scores[a])) for a in agents]
+            return cls._side_arrays(agents, candidates, orders, ranks, fitness)
+
+        recipient_side = side(recipients, caregivers,
+                              data['recipient_subjective_preferences'], data['fitness_scores'])
+        caregiver_side = side(caregivers, recipients,
+                              data['caregiver_subjective_preferences'], data['caregiver_fitness_scores'])
+        return cls(cls._assemble(recipients, caregivers, recipient_side, caregiver_side,
+                                 list(range(len(caregivers))), list(range(len(recipients))),
+                                 [data['caregiver_capacities'][c] for c in caregivers]))
+
+    @classmethod
+    def from_csv_data(cls, care_receivers_data: Dict, care_workers_data: Dict,
+                      fitness_scales: Optional[Dict[str, int]] = None,
+                      column_orders: Optional[Dict[str, List[int]]] = None) -> 'MatchingInstance':
+        """
+        CSVInputHandler の読み込み結果（care_receivers_data / care_workers_data）から変換
+
+        CSV の列の並びも保存し、to_csv_data で同じ辞書を復元できるようにする。
+
+        Args:
+            fitness_scales: CSVInputHandler.fitness_scales（メタ情報として保存）
+            column_orders: CSVInputHandler.column_orders（{'care_receivers': [列のID順],
+                'care_workers': [列のID順]}）。省略時は各エージェントのキー順から推定する
+
+        Raises:
+            ConstraintViolationError: 候補者の列に相手側の行に存在しない ID がある場合
+        """
+        recipients = list(care_receivers_data)
+        caregivers = list(care_workers_data)
+
+        def side(agents_data, agents, candidates):
+            orders, ranks, fitness = [], [], []
+            for a in agents:
+                subjective = agents_data[a]['subjective_preferences']
+                orders.append(agents_data[a].get('preference_order') or
+                              sorted(subjective, key=subjective.get))
+                ranks.append({c: r - 1 for c, r in subjective.items()})
+                fitness.append(agents_data[a]['objective_fitness'])
+            return cls._side_arrays(agents, candidates, orders, ranks, fitness)
+
+        def columns(agents_data, candidates, group):
+            index = {c: j for j, c in enumerate(candidates)}
+            if column_orders and group in column_orders:
+                keys = column_orders[group]
+            else:
+                # 推定: 全エージェントのランキング・フィット度のキーを出現順に並べる
+                keys = dict.fromkeys(c for data in agents_data.values()
+                                     for c in list(data['subjective_preferences']) +
+                                     list(data['objective_fitness']))
+            try:
+                ordered = [index[c] for c in keys]
+            except KeyError as e:
+                raise ConstraintViolationError(f"相手側に存在しないIDが含まれています: {e.args[0]}") from e
+            seen = set(ordered)
+            return ordered + [j for j in range(len(candidates)) if j not in seen]
+
+        recipient_side = side(care_receivers_data, recipients, caregivers)
+        caregiver_side = side(care_workers_data, caregivers, recipients)
+        instance = cls(cls._assemble(
+            recipients, caregivers, recipient_side, caregiver_side,
+            columns(care_receivers_data, caregivers, 'care_receivers'),
+            columns(care_workers_data, recipients, 'care_workers'),
+            [care_workers_data[c]['capacity'] for c in caregivers]
+        ))
+        if fitness_scales:
+            instance.metadata['fitness_scales'] = dict(fitness_scales)
+        return instance
+
+    @staticmethod
+    def _assemble(recipients, caregivers, recipient_side, caregiver_side,
+                  recipient_columns, caregiver_columns, capacities) -> Dict[str, np.ndarray]:
+        return {
+            'recipient_ids': np.asarray(recipients, dtype=np.int64),
+            'caregiver_ids': np.asarray(caregivers, dtype=np.int64),
+            'recipient_preferences': recipient_side['preferences'],
+            'recipient_ranks': recipient_side['ranks'],
+            'recipient_fitness': recipient_side['fitness'],
+            'recipient_columns': np.asarray(recipient_columns, dtype=np.int32),
+            'caregiver_preferences': caregiver_side['preferences'],
+            'caregiver_ranks': caregiver_side['ranks'],
+            'caregiver_fitness': caregiver_side['fitness'],
+            'caregiver_columns': np.asarray(caregiver_columns, dtype=np.int32),
+            'capacities': np.asarray(capacities, dtype=np.int32),
+        }
+
+    def to_csv_data(self) -> Dict[str, Dict]:
+        """
+        CSVInputHandler の読み込み結果と同じ辞書形式に戻す
+
+        Returns:
+            Dict: {'care_receivers': 被介護者データ, 'care_workers': ケアワーカーデータ}
+        """
+        recipients = self.recipient_ids.tolist()
+        caregivers = self.caregiver_ids.tolist()
+
+        def side(agents, candidates, prefix):
+            columns = np.asarray(self.arrays[f'{prefix}_columns'])
+            column_ids = [candidates[j] for j in columns.tolist()]
+            ranks = np.asarray(self.arrays[f'{prefix}_ranks'])[:, columns] + 1
+            fitness = np.asarray(self.arrays[f'{prefix}_fitness'])[:, columns]
+            rank_rows, fitness_rows = ranks.tolist(), fitness.tolist()
+            ranks_complete = (ranks > 0).all(axis=1).tolist()
+            fitness_complete = (fitness >= 0).all(axis=1).tolist()
+            preferences = np.asarray(self.arrays[f'{prefix}_preferences'])
+            lengths = (preferences >= 0).sum(axis=1).tolist()
+            ordered_ids = np.asarray(candidates, dtype=np.int64)[np.maximum(preferences, 0)].tolist()
+            data = {}
+            for i, agent_id in enumerate(agents):
+                data[agent_id] = {
+                    'subjective_preferences': (
+                        dict(zip(column_ids, rank_rows[i])) if ranks_complete[i] else
+                        {c: r for c, r in zip(column_ids, rank_rows[i]) if r > 0}
+                    ),
+                    'objective_fitness': (
+                        dict(zip(column_ids, fitness_rows[i])) if fitness_complete[i] else
+                        {c: v for c, v in zip(column_ids, fitness_rows[i]) if v >= 0}
+                    ),
+                    'preference_order': ordered_ids[i][:lengths[i]]
+                }
+            return data
+
+        workers = side(caregivers, recipients, 'caregiver')
+        for worker_id, capacity in zip(caregivers, self.capacities.tolist()):
+            workers[worker_id]['capacity'] = capacity
+        return {'care_receivers': side(recipients, caregivers, 'recipient'),
+                'care_workers': workers}
+
+    def to_sample_data(self) -> Dict:
+        """
+        generate_sample_data と同じ辞書形式に戻す（欠損のない完全なインスタンスのみ）
+
+        Raises:
+            ConstraintViolationError: 選好またはフィット度に欠損がある場合
+        """
+        if ((np.asarray(self.recipient_preferences) < 0).any() or
+                (np.asarray(self.caregiver_preferences) < 0).any() or
+                (np.asarray(self.recipient_fitness) < 0).any() or
+                (np.asarray(self.caregiver_fitness) < 0).any()):
+            raise ConstraintViolationError("欠損のあるインスタンスは辞書形式に変換できません")
+        recipients = self.recipient_ids.tolist()
+        caregivers = self.caregiver_ids.tolist()
+        recipient_orders = self.caregiver_ids[self.recipient_preferences].tolist()
+        caregiver_orders = self.recipient_ids[self.caregiver_preferences].tolist()
+        return {
+            'care_recipients': recipients,
+            'caregivers': caregivers,
+            'caregiver_capacities': dict(zip(caregivers, self.capacities.tolist())),
+            'recipient_subjective_preferences': dict(zip(recipients, recipient_orders)),
+            'caregiver_subjective_preferences': dict(zip(caregivers, caregiver_orders)),
+            'fitness_scores': dict(zip(recipients, self.recipient_fitness.tolist())),
+            'caregiver_fitness_scores': dict(zip(caregivers, self.caregiver_fitness.tolist())),
+        }
+
+    def save(self, directory: str) -> str:
+        """
+        配列ごとの .npy とメタ情報 meta.json をディレクトリに保存
+
+        一時ディレクトリに書き出してから置き換えるため、並行して読み込む側が
+        書きかけのインスタンスを見ることはない。
+
+        Returns:
+            str: 保存先ディレクトリ
+        """
+        parent = os.path.dirname(os.path.abspath(directory))
+        os.makedirs(parent, exist_ok=True)
+        staging = tempfile.mkdtemp(prefix='.instance-', dir=parent)
+        try:
+            for name in self.ARRAY_NAMES:
+                np.save(os.path.join(staging, f'{name}.npy'),
+                        np.ascontiguousarray(self.arrays[name]), allow_pickle=False)
+            with open(os.path.join(staging, 'meta.json'), 'w', encoding='utf-8') as f:
+                json.dump({'format_version': self.FORMAT_VERSION, **self.metadata},
+                          f, ensure_ascii=False, indent=2)
+            if os.path.isdir(directory):
+                shutil.rmtree(directory)
+            os.replace(staging, directory)
+        except BaseException:
+            shutil.rmtree(staging, ignore_errors=True)
+            raise
+        return directory
+
+    @classmethod
+    def load(cls, directory: str, mmap_mode: Optional[str] = 'r') -> 'MatchingInstance':
+        """
+        save で保存したインスタンスを読み込む
+
+        Args:
+            directory: 保存先ディレクトリ
+            mmap_mode: np.load に渡すメモリマップのモード（None なら通常の読み込み）
+
+        Raises:
+            ValueError: 形式のバージョンが異なる場合
+        """
+        with open(os.path.join(directory, 'meta.json'), encoding='utf-8') as f:
+            metadata = json.load(f)
+        version = metadata.pop('format_version', None)
+        if version != cls.FORMAT_VERSION:
+            raise ValueError(f"インスタンス形式のバージョンが異なります: {version} != {cls.FORMAT_VERSION}")
+        arrays = {
+            name: np.load(os.path.join(directory, f'{name}.npy'),
+                          mmap_mode=mmap_mode, allow_pickle=False)
+            for name in cls.ARRAY_NAMES
+        }
+        return cls(arrays, metadata)
@@ -0,0 +1,256 @@
+#!/usr/bin/env python3
+"""
+マッチング結果の書き出し
+
+CareMatchingSystem.run_complete_matching の結果辞書を次のいずれかの形式で保存します。
+
+- json: 従来と同じ1つの JSON 文書（インデント付き）
+- ndjson: 1行1レコードの JSON Lines。エージェント・マッチごとにレコードを作って
+  その場で書き出すため、結果全体の JSON 文字列や変換済みのコピーをメモリに持たない
+- binary: 統合選好・マッチング・スコアを整数/浮動小数の配列にまとめた圧縮 .npz
+
+計算詳細（拡張版Kemenyルールの all_calculations と DA の履歴）は
+"all"（全て）/ "summary"（件数に置き換え）/ "none"（省略）から選べます。
+
+Author: 倉持誠 (Makoto Kuramochi)
+"""
+
+import json
+from array import array
+from typing import Dict, Iterator, List
+import numpy as np
+
+
+class ResultWriter:
+    """マッチング結果をファイルに書き出すクラス"""
+
+    FORMATS = ("json", "ndjson", "binary")
+    DETAIL_LEVELS = ("all", "summary", "none")
+    FORMAT_VERSION = 1
+
+    def __init__(self, calculation_details: str = "all"):
+        """
+        Args:
+            calculation_details: 計算詳細の扱い
+                - "all": 全ての計算詳細を保存（既定）
+                - "summary": all_calculations は件数（calculation_count）、DA の履歴は
+                  ステップ数（history_steps）に置き換える
+                - "none": 統合の計算詳細と DA の履歴を保存しない
+        """
+        if calculation_details not in self.DETAIL_LEVELS:
+            raise ValueError(f"calculation_details は {self.DETAIL_LEVELS} のいずれかを指定してください")
+        self.calculation_details = calculation_details
+
+    @staticmethod
+    def json_default(obj):
+        """json.dump で NumPy の値・配列と array を扱うための変換"""
+        if isinstance(obj, (np.ndarray, array)):
+            return obj.tolist()
+        elif isinstance(obj, np.integer):
+            return int(obj)
+        elif isinstance(obj, np.floating):
+            return float(obj)
+        elif isinstance(obj, (set, tuple)):
+            return list(obj)
+        raise TypeError(f"JSON に変換できない型です: {type(obj).__name__}")
+
+    def _integration(self, details: Dict) -> Dict:
+        """1エージェント分の統合詳細を詳細レベルに合わせて（コピーせずに）絞り込む"""
+        if self.calculation_details == "all" or 'all_calculations' not in details:
+            return details
+        summary = {k: v for k, v in details.items() if k != 'all_calculations'}
+        summary['calculation_count'] = len(details['all_calculations'])
+        return summary
+
+    def _da_details(self, da_details: Dict) -> Dict:
+        if self.calculation_details == "all":
+            return da_details
+        summary = {k: v for k, v in da_details.items() if k not in ('history', 'events')}
+        if self.calculation_details == "summary":
+            summary['history_steps'] = len(da_details.get('history', ()))
+            if 'events' in da_details:
+                summary['event_count'] = len(da_details['events']) // 4
+        return summary
+
+    def filtered_results(self, results: Dict) -> Dict:
+        """詳細レベルを適用した結果辞書（大きな要素はコピーせずに共有する）"""
+        if self.calculation_details == "all":
+            return results
+        filtered = dict(results)
+        if self.calculation_details == "none":
+            filtered.pop('integration_details', None)
+        elif 'integration_details' in results:
+            filtered['integration_details'] = {
+                side: {agent_id: self._integration(d) for agent_id, d in agents.items()}
+                for side, agents in results['integration_details'].items()
+            }
+        if 'da_details' in results:
+            filtered['da_details'] = self._da_details(results['da_details'])
+        return filtered
+
+    def iter_records(self, results: Dict) -> Iterator[Dict]:
+        """
+        結果辞書を NDJSON 用のレコードに分解して順に返す
+
+        レコードの種類（'type'）:
+            meta: 形式バージョン・詳細レベル・システムパラメータ・人数
+            recipient / caregiver: 1エージェント分の入力・統合選好・統合の計算詳細
+            match: 1組のマッチング
+            da: DA の統計（提案回数・ラウンド数・未マッチ・利用数）
+            da_step: DA の履歴1ステップ分（calculation_details="all" のみ）
+            da_events: compact トレースのイベント列（calculation_details="all" のみ）
+        """
+        data = results.get('input_data', {})
+        integration = results.get('integration_details', {})
+        integrated = results.get('integrated_preferences', {})
+        recipients = data.get('care_recipients', list(integrated.get('recipients', {})))
+        caregivers = data.get('caregivers', list(integrated.get('caregivers', {})))
+
+        yield {
+            'type': 'meta',
+            'format_version': self.FORMAT_VERSION,
+            'calculation_details': self.calculation_details,
+            'system_parameters': results.get('system_parameters', {}),
+            'n_recipients': len(recipients),
+            'n_caregivers': len(caregivers),
+        }
+
+        sides = (
+            ('recipient', 'recipients', recipients,
+             data.get('recipient_subjective_preferences', {}), data.get('fitness_scores', {})),
+            ('caregiver', 'caregivers', caregivers,
+             data.get('caregiver_subjective_preferences', {}), data.get('caregiver_fitness_scores', {})),
+        )
+        for record_type, side, agent_ids, subjective, fitness in sides:
+            for agent_id in agent_ids:
+                record = {
+                    'type': record_type,
+                    'id': agent_id,
+                    'subjective_preference': subjective.get(agent_id),
+                    'fitness_scores': fitness.get(agent_id),
+                    'integrated_preference': integrated.get(side, {}).get(agent_id),
+                }
+                if record_type == 'caregiver':
+                    record['capacity'] = data.get('caregiver_capacities', {}).get(agent_id)
+                if self.calculation_details != "none" and agent_id in integration.get(side, {}):
+                    record['integration'] = self._integration(integration[side][agent_id])
+                yield record
+
+        for recipient, caregiver in results.get('final_matches', {}).items():
+            yield {'type': 'match', 'recipient': recipient, 'caregiver': caregiver}
+
+        if 'da_details' in results:
+            da_details = results['da_details']
+            summary = {k: v for k, v in self._da_details(da_details).items()
+                       if k not in ('final_matches', 'history', 'events')}
+            yield {'type': 'da', **summary}
+            if self.calculation_details == "all":
+                for step in da_details.get('history', ()):
+                    yield {'type': 'da_step', **step}
+                if 'events' in da_details:
+                    yield {'type': 'da_events', 'events': da_details['events']}
+
+    def write_json(self, results: Dict, filename: str):
+        """1つの JSON 文書として保存（変換は json.dump の default で1回だけ行う）"""
+        with open(filename, 'w', encoding='utf-8') as f:
+            json.dump(self.filtered_results(results), f, ensure_ascii=False, indent=2,
+                      default=self.json_default)
+
+    def write_ndjson(self, results: Dict, filename: str) -> int:
+        """
+        1行1レコードの NDJSON として逐次保存
+
+        Returns:
+            int: 書き出したレコード数
+        """
+        count = 0
+        with open(filename, 'w', encoding='utf-8') as f:
+            for record in self.iter_records(results):
+                f.write(json.dumps(record, ensure_ascii=False, default=self.json_default))
+                f.write('\n')
+                count += 1
+        return count
+
+    def write_binary(self, results: Dict, filename: str):
+        """
+        統合選好・マッチング・スコアを配列にまとめた圧縮 .npz として保存
+
+        計算詳細は含まない（各エージェントの best_score のみ）。選好は ID の行列で、
+        長さの足りない行は -1 で埋める。np.savez_compressed の仕様により、
+        filename が .npz で終わらない場合は拡張子が付け加えられる。
+        """
+        data = results.get('input_data', {})
+        integrated = results.get('integrated_preferences', {})
+        integration = results.get('integration_details', {})
+        recipients = list(data.get('care_recipients', integrated.get('recipients', {})))
+        caregivers = list(data.get('caregivers', integrated.get('caregivers', {})))
+        matches = results.get('final_matches', {})
+        da_details = results.get('da_details', {})
+        parameters = results.get('system_parameters', {})
+
+        def preference_matrix(agent_ids: List[int], preferences: Dict) -> np.ndarray:
+            width = max((len(preferences.get(a, ())) for a in agent_ids), default=0)
+            matrix = np.full((len(agent_ids), width), -1, dtype=np.int64)
+            for i, agent_id in enumerate(agent_ids):
+                ranking = preferences.get(agent_id, ())
+                matrix[i, :len(ranking)] = ranking
+            return matrix
+
+        def best_scores(agent_ids: List[int], details: Dict) -> np.ndarray:
+            return np.array([details.get(a, {}).get('best_score', np.nan) for a in agent_ids],
+                            dtype=np.float64)
+
+        capacities = data.get('caregiver_capacities', {})
+        np.savez_compressed(
+            filename,
+            format_version=np.array(self.FORMAT_VERSION),
+            recipient_ids=np.asarray(recipients, dtype=np.int64),
+            caregiver_ids=np.asarray(caregivers, dtype=np.int64),
+            capacities=np.asarray([capacities.get(c, 0) for c in caregivers], dtype=np.int64),
+            recipient_preferences=preference_matrix(recipients, integrated.get('recipients', {})),
+            caregiver_preferences=preference_matrix(caregivers, integrated.get('caregivers', {})),
+            matches=np.asarray([matches.get(r, -1) for r in recipients], dtype=np.int64),
+            recipient_best_scores=best_scores(recipients, integration.get('recipients', {})),
+            caregiver_best_scores=best_scores(caregivers, integration.get('caregivers', {})),
+            da_stats=np.asarray([da_details.get('proposals', -1), da_details.get('rounds', -1)],
+                                dtype=np.int64),
+            weights=np.asarray([parameters.get('preference_weight', np.nan),
+                                parameters.get('fitness_weight', np.nan)], dtype=np.float64),
+        )
+
+    def write(self, results: Dict, filename: str, format: str = "json"):
+        """
+        指定形式で結果を保存
+
+        Args:
+            results: run_complete_matching の結果辞書
+            filename: 保存ファイル名
+            format: "json" / "ndjson" / "binary"
+        """
+        if format not in self.FORMATS:
+            raise ValueError(f"format は {self.FORMATS} のいずれかを指定してください")
+        getattr(self, f"write_{format}")(results, filename)
+
+    @staticmethod
+    def read_ndjson(filename: str) -> Iterator[Dict]:
+        """NDJSON 形式の結果を1レコードずつ読み込む"""
+        with open(filename, encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+    @staticmethod
+    def read_binary(filename: str) -> Dict:
+        """
+        binary 形式の結果を読み込み、マッチングを ID の辞書に戻して返す
+
+        Returns:
+            Dict: 保存した配列と 'final_matches'（{被介護者ID: ケアワーカーID}）
+        """
+        with np.load(filename, allow_pickle=False) as archive:
+            arrays = {name: archive[name] for name in archive.files}
+        arrays['final_matches'] = {
+            r: c for r, c in zip(arrays['recipient_ids'].tolist(), arrays['matches'].tolist())
+            if c >= 0
+        }
+        return arrays
@@ -15,6 +15,7 @@ Author: 倉持誠 (Makoto Kuramochi)
 
 from typing import List, Dict, Any, Tuple, Union, Sequence, Mapping
 import math
+import numpy as np
 
 
 class ConstraintViolationError(Exception):
@@ -125,6 +126,51 @@ class InputValidator:
                 f"{entity_name}のフィット度に重複があります: {list(duplicates)}"
             )
     
+    @staticmethod
+    def validate_fitness_matrix(fitness_matrix: Union[np.ndarray, Sequence[Sequence[Union[int, float]]]],
+                                entity_name: str = "エンティティ") -> np.ndarray:
+        """
+        複数エージェント分のフィット度（1行=1エージェント）を一括検証
+        
+        validate_fitness_scores_are_integers と validate_fitness_uniqueness を
+        全行に適用したのと同じ制約を NumPy でまとめて判定し、違反行があれば
+        その行を個別の検証関数に渡して同じ例外を送出する。
+        
+        Args:
+            fitness_matrix: フィット度行列（エージェント数 x 候補者数）
+            entity_name: エンティティ名（エラーメッセージ用）
+            
+        Returns:
+            np.ndarray: 検証済みの整数行列（int64）
+            
+        Raises:
+            ConstraintViolationError: 整数制限・単射性違反時
+        """
+        matrix = np.asarray(fitness_matrix)
+        
+        if matrix.dtype.kind not in "iuf" or matrix.ndim != 2:
+            # 数値行列でない場合は1行ずつ従来の検証を行う
+            for i, row in enumerate(np.asarray(fitness_matrix, dtype=object).reshape(len(matrix), -1).tolist()):
+                InputValidator.validate_fitness_scores_are_integers(row)
+                InputValidator.validate_fitness_uniqueness(row, f"{entity_name}[{i}]")
+            return np.asarray(fitness_matrix, dtype=np.int64)
+        
+        invalid = matrix < 0
+        if matrix.dtype.kind == "f":
+            invalid |= ~np.isfinite(matrix) | (matrix != np.floor(matrix))
+        int_matrix = np.where(invalid, 0, matrix).astype(np.int64)
+        sorted_rows = np.sort(int_matrix, axis=1)
+        duplicated = (sorted_rows[:, 1:] == sorted_rows[:, :-1]).any(axis=1)
+        
+        bad_rows = np.flatnonzero(invalid.any(axis=1) | duplicated)
+        if len(bad_rows):
+            i = int(bad_rows[0])
+            row = matrix[i].tolist()
+            InputValidator.validate_fitness_scores_are_integers(row)
+            InputValidator.validate_fitness_uniqueness(row, f"{entity_name}[{i}]")
+        
+        return int_matrix
+    
     @staticmethod
     def validate_preference_consistency(participant_ids: List[int],
                                       preference_dict: Dict[int, List[int]],